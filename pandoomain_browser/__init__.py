@@ -0,0 +1,6 @@
+"""
+Pandoomain browser: the HTML visualizer and the servers behind it.
+
+    serve.py  static files and the database with HTTP Range requests
+    api.py    JSON query API over the database
+"""
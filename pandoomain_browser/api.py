@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+JSON query API over the browser database.
+
+    python -m pandoomain_browser.api results/browser_files/pandoomain.db
+
+Opens pandoomain.db read-only and answers the queries of the browser,
+so a single server can host the results for many users without
+each tab downloading the database:
+
+    GET /api/health                           database summary
+    GET /api/search?q=TERM[&page=P&size=S]    {results: [{genome, nei, org}], more}
+    GET /api/neighborhood?genome=G&nei=N      the neighborhood tile
+    GET /api/domains?pid=P[&pid=Q...]         {pid: [domains]}
+
+Anything else is a file of the browser directory, so the page is
+served from the same origin and uses the API when it finds it.
+
+Queries run on a pool of read-only connections in worker threads,
+each connection keeping its prepared statements. Responses are kept
+in an LRU cache, the database does not change while served.
+
+A sharded database (browser_build.py --shards) is served from its
+manifest: neighborhoods and domains are read from the shard the manifest
+gives for the genome or pid, searches run on every shard and are merged.
+Each shard ranks its full-text matches by bm25 with its own term
+frequencies, so the merged order is close to, not the same as, the order
+of one database: a rare word of one shard ranks high there even if it is
+common in the others. Exact genome and pid matches still come first.
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import mimetypes
+import sqlite3
+import sys
+import zlib
+from collections import OrderedDict
+from http import HTTPStatus
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+BROWSER_DIR = Path(__file__).parent
+POOL_SIZE = 8  # connections
+CACHE_SIZE = 4096  # responses
+MAX_PIDS = 1000  # per domains request
+MAX_HEADER = 1 << 16  # bytes
+PAGE_SIZE = 50  # search results
+MAX_PAGE_SIZE = 500
+# Full-text matches ranked per search. Ranking every match of a common
+# word is slow on large databases, the first ones are ranked instead
+SEARCH_CANDIDATES = 2000
+
+# Exact genome and pid matches first, then the full-text matches by bm25.
+# The trigram index needs three characters, shorter terms match exactly only
+SEARCH = """
+    WITH exact AS (
+        SELECT genome_id, nei FROM genes
+        WHERE genome_id = (SELECT genome_id FROM genomes WHERE genome = :term)
+        UNION
+        SELECT genome_id, nei FROM genes
+        WHERE pid_id = (SELECT pid_id FROM proteins WHERE pid = :term)
+    ),
+    hits AS (
+        SELECT rowid AS tile_id, rank FROM search
+        WHERE search MATCH :match
+        LIMIT :candidates
+    ),
+    matches AS (
+        SELECT genome_id, nei, -1e9 AS score FROM exact
+        UNION ALL
+        SELECT t.genome_id, t.nei, hits.rank FROM hits JOIN tiles t USING (tile_id)
+    )
+    SELECT MIN(m.score) AS score, g.genome, m.nei, g.org
+    FROM matches m JOIN genomes g USING (genome_id)
+    GROUP BY m.genome_id, m.nei
+    ORDER BY score, g.genome, m.nei
+    LIMIT :limit OFFSET :offset
+"""
+
+TILE = """
+    SELECT t.tile FROM tiles t JOIN genomes g USING (genome_id)
+    WHERE g.genome = :genome AND t.nei = :nei
+"""
+
+DOMAINS = """
+    SELECT d.start, d.stop, d.length, f.pfam, f.pfam_desc
+    FROM proteins p
+    JOIN domains d USING (pid_id)
+    LEFT JOIN pfams f USING (pfam_id)
+    WHERE p.pid = :pid
+    ORDER BY d.n
+"""
+
+HEALTH = """
+    SELECT
+        (SELECT COUNT(*) FROM genomes),
+        (SELECT COUNT(*) FROM tiles),
+        (SELECT COUNT(*) FROM proteins)
+"""
+
+SHARDS = "SELECT shard_id, file FROM shards ORDER BY shard_id"
+GENOME_SHARDS = "SELECT shard_id FROM genomes WHERE genome = :genome"
+PID_SHARDS = "SELECT shard_id FROM proteins WHERE pid = :pid"
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def read_only(db: str) -> str:
+    # Quoted, a ? or # in the path would start the query or fragment
+    return f"file:{quote(str(db))}?mode=ro"
+
+
+class ConnectionPool:
+    """
+    Read-only SQLite connections shared by the worker threads.
+
+    Args:
+        db: Path to the database.
+        size: Number of connections.
+    """
+
+    def __init__(self, db: str, size: int = POOL_SIZE):
+        self.connections: asyncio.Queue = asyncio.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(
+                read_only(db),
+                uri=True,
+                check_same_thread=False,
+                cached_statements=64,
+            )
+            self.connections.put_nowait(conn)
+
+    async def fetchall(self, sql: str, params) -> List[Tuple]:
+        conn = await self.connections.get()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, lambda: conn.execute(sql, params).fetchall()
+            )
+        finally:
+            self.connections.put_nowait(conn)
+
+    def close(self) -> None:
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+
+
+class Shards:
+    """
+    The connection pools of a database, or of each shard of a manifest.
+
+    Args:
+        db: Path to the database or the manifest.
+        size: Number of connections per database.
+    """
+
+    def __init__(self, db: str, size: int = POOL_SIZE):
+        conn = sqlite3.connect(read_only(db), uri=True)
+        try:
+            tables = conn.execute("SELECT name FROM sqlite_schema").fetchall()
+            files = conn.execute(SHARDS).fetchall() if ("shards",) in tables else []
+        finally:
+            conn.close()
+
+        self.manifest = ConnectionPool(db, size) if files else None
+        if files:
+            self.pools = {
+                shard_id: ConnectionPool(str(Path(db).parent / file), size)
+                for shard_id, file in files
+            }
+        else:
+            self.pools = {0: ConnectionPool(db, size)}
+
+    async def route(self, sql: str, params) -> List[ConnectionPool]:
+        # Pools of the shards the manifest gives, the only pool when not sharded
+        if self.manifest is None:
+            return list(self.pools.values())
+        rows = await self.manifest.fetchall(sql, params)
+        return [self.pools[shard_id] for (shard_id,) in rows]
+
+    def close(self) -> None:
+        for pool in [self.manifest, *self.pools.values()]:
+            if pool is not None:
+                pool.close()
+
+
+class LRUCache:
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.items: OrderedDict = OrderedDict()
+
+    def get(self, key) -> Optional[bytes]:
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        return None
+
+    def put(self, key, value: bytes) -> None:
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+
+class API:
+    """
+    The endpoints, returning JSON bodies as bytes.
+    """
+
+    def __init__(self, shards: Shards, cache: LRUCache):
+        self.shards = shards
+        self.cache = cache
+        self.routes = {
+            "/api/health": self.health,
+            "/api/search": self.search,
+            "/api/neighborhood": self.neighborhood,
+            "/api/domains": self.domains,
+        }
+
+    async def handle(self, path: str, query: Dict[str, List[str]]) -> bytes:
+        endpoint = self.routes.get(path)
+        if endpoint is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        if (body := self.cache.get(key)) is None:
+            body = await endpoint(query)
+            self.cache.put(key, body)
+        return body
+
+    async def health(self, query) -> bytes:
+        results = await asyncio.gather(
+            *(pool.fetchall(HEALTH, ()) for pool in self.shards.pools.values())
+        )
+        # Proteins in several shards are counted once per shard
+        genomes, neighborhoods, proteins = map(sum, zip(*(rows[0] for rows in results)))
+        return dumps(
+            {
+                "genomes": genomes,
+                "neighborhoods": neighborhoods,
+                "proteins": proteins,
+                "shards": len(self.shards.pools),
+            }
+        )
+
+    async def search(self, query) -> bytes:
+        term = one(query, "q")
+        page = integer(query, "page", 1)
+        size = integer(query, "size", PAGE_SIZE)
+        if page < 1 or not 1 <= size <= MAX_PAGE_SIZE:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, f"page >= 1 and size in 1..{MAX_PAGE_SIZE}"
+            )
+
+        # One more row than asked tells if there is a next page. Shards are
+        # asked for every row up to the page, and merged in rank order
+        offset = (page - 1) * size
+        params = {
+            "term": term,
+            "match": phrase(term),
+            "candidates": SEARCH_CANDIDATES,
+            "limit": size + 1,
+            "offset": offset,
+        }
+        pools = list(self.shards.pools.values())
+        if len(pools) > 1:
+            params.update(limit=offset + size + 1, offset=0)
+        results = await asyncio.gather(
+            *(pool.fetchall(SEARCH, params) for pool in pools)
+        )
+        rows = list(heapq.merge(*results))
+        if len(pools) > 1:
+            rows = rows[offset:]
+        results = [
+            {"genome": genome, "nei": nei, "org": org} for _, genome, nei, org in rows
+        ]
+        return dumps(
+            {"results": results[:size], "page": page, "more": len(results) > size}
+        )
+
+    async def neighborhood(self, query) -> bytes:
+        genome = one(query, "genome")
+        nei = integer(query, "nei")
+
+        params = {"genome": genome, "nei": nei}
+        pools = await self.shards.route(GENOME_SHARDS, params)
+        rows = await pools[0].fetchall(TILE, params) if pools else []
+        if not rows:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No neighborhood {genome} {nei}")
+        # The tile is already JSON
+        return zlib.decompress(rows[0][0])
+
+    async def domains(self, query) -> bytes:
+        pids = query.get("pid", [])
+        if not pids:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Missing pid")
+        if len(pids) > MAX_PIDS:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"At most {MAX_PIDS} pids")
+
+        results = await asyncio.gather(*(self.pid_domains(pid) for pid in pids))
+        columns = ("start", "stop", "length", "pfam", "pfam_desc")
+        return dumps(
+            {
+                pid: [dict(zip(columns, row)) for row in rows]
+                for pid, rows in zip(pids, results)
+            }
+        )
+
+    async def pid_domains(self, pid: str) -> List[Tuple]:
+        # Every shard with the pid has all its domains, the first one does
+        pools = await self.shards.route(PID_SHARDS, {"pid": pid})
+        return await pools[0].fetchall(DOMAINS, {"pid": pid}) if pools else []
+
+
+def dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def one(query: Dict[str, List[str]], name: str) -> str:
+    values = query.get(name)
+    if not values or not values[0]:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Missing {name}")
+    return values[0]
+
+
+def integer(
+    query: Dict[str, List[str]], name: str, default: Optional[int] = None
+) -> int:
+    if default is not None and name not in query:
+        return default
+    try:
+        return int(one(query, name))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+
+
+def phrase(term: str) -> str:
+    """
+    The term as an FTS5 phrase, a substring match with the trigram tokenizer.
+    """
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def static_file(path: str) -> Tuple[bytes, str]:
+    if path == "/":
+        path = "/pandoomain-browser.html"
+    target = (BROWSER_DIR / unquote(path).lstrip("/")).resolve()
+    if BROWSER_DIR.resolve() not in target.parents or not target.is_file():
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+    if target.suffix in (".py", ".pyc"):
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+    content_type = mimetypes.guess_type(target.name)[0] or "application/octet-stream"
+    return target.read_bytes(), content_type
+
+
+async def respond(
+    writer: asyncio.StreamWriter,
+    status: HTTPStatus,
+    body: bytes,
+    content_type: str,
+    head: bool = False,
+) -> None:
+    headers = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: keep-alive",
+    ]
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"))
+    if not head:
+        writer.write(body)
+    await writer.drain()
+
+
+async def handle_client(
+    api: API, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    try:
+        while True:
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+
+            request_line = request.split(b"\r\n", 1)[0].decode("latin-1")
+            try:
+                method, target, _ = request_line.split(" ", 2)
+            except ValueError:
+                await respond(writer, HTTPStatus.BAD_REQUEST, b"", "text/plain")
+                break
+
+            url = urlsplit(target)
+            try:
+                if method not in ("GET", "HEAD"):
+                    raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+                if url.path.startswith("/api/"):
+                    body = await api.handle(url.path, parse_qs(url.query))
+                    content_type = "application/json"
+                else:
+                    body, content_type = static_file(url.path)
+                status = HTTPStatus.OK
+            except HTTPError as e:
+                status, content_type = e.status, "application/json"
+                body = dumps({"error": str(e)})
+            except sqlite3.Error as e:
+                print(f"ERROR: {e}", file=sys.stderr)
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+                content_type = "application/json"
+                body = dumps({"error": "Database error"})
+
+            await respond(writer, status, body, content_type, head=method == "HEAD")
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(db: str, host: str, port: int, pool_size: int, cache_size: int) -> None:
+    shards = Shards(db, pool_size)
+    api = API(shards, LRUCache(cache_size))
+
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(api, r, w), host, port, limit=MAX_HEADER
+    )
+    print(f"Serving http://{host}:{port}/pandoomain-browser.html")
+    print(f"API over {db} ({len(shards.pools)} shards)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        shards.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="JSON query API over the browser database."
+    )
+    parser.add_argument("db", help="pandoomain.db built by browser_build.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pool", type=int, default=POOL_SIZE, help="Connections")
+    parser.add_argument("--cache", type=int, default=CACHE_SIZE, help="Responses")
+    args = parser.parse_args()
+
+    if not Path(args.db).is_file():
+        print(f"ERROR: {args.db} not found", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.pool, args.cache))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Serve the browser and its database over HTTP, with Range requests.
+
+    pandoomain_browser/serve.py results/browser_files
+
+The page is served at http://localhost:8000/ and the databases of the
+given directory under /db/. Requests for part of a file (Range: bytes=...)
+get only those bytes, so the page opens the database in place
+(see lazy loading in docs/README.md) and reads just the pages its queries
+touch, instead of copying the whole file into the tab.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BROWSER_DIR = Path(__file__).parent
+RANGE_REGEX = re.compile(r"bytes=(\d*)-(\d*)$")
+COPY_SIZE = 1 << 16  # bytes
+
+# Served along the usual types
+EXTRA_TYPES = {
+    ".db": "application/octet-stream",
+    ".wasm": "application/wasm",
+    ".mjs": "text/javascript",
+}
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """
+    Static files with single-range support; /db/ maps to the database directory.
+    Other Range headers are ignored and get the whole file.
+    """
+
+    extensions_map = {**SimpleHTTPRequestHandler.extensions_map, **EXTRA_TYPES}
+
+    def __init__(self, *args, db_dir: Path, **kwargs):
+        self.db_dir = db_dir
+        super().__init__(*args, **kwargs)
+
+    def translate_path(self, path: str) -> str:
+        if path.startswith("/db/"):
+            name = os.path.basename(path[len("/db/") :].split("?", 1)[0])
+            return str(self.db_dir / name)
+        return super().translate_path(path)
+
+    def end_headers(self) -> None:
+        self.send_header("Accept-Ranges", "bytes")
+        # Revalidate, the database changes when it is rebuilt
+        self.send_header("Cache-Control", "no-cache")
+        super().end_headers()
+
+    def send_head(self):
+        self.range_left = None
+        header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if header is None or not os.path.isfile(path):
+            return super().send_head()
+
+        # A Range that does not parse, or asks for several ranges,
+        # is ignored (RFC 9110 14.2): the whole file, 200
+        match = RANGE_REGEX.match(header.strip())
+        if match is None or match.groups() == ("", ""):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+
+        first, last = match.groups()
+        if first == "":  # the last N bytes
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+
+        if start >= size or start > end:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        h = open(path, "rb")
+        h.seek(start)
+        self.range_left = end - start + 1
+
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(self.range_left))
+        self.end_headers()
+        return h
+
+    def copyfile(self, source, outputfile) -> None:
+        left = self.range_left
+        if left is None:
+            shutil.copyfileobj(source, outputfile, COPY_SIZE)
+            return
+        while left > 0 and (chunk := source.read(min(COPY_SIZE, left))):
+            outputfile.write(chunk)
+            left -= len(chunk)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve the browser and its database with HTTP Range support."
+    )
+    parser.add_argument("db_dir", help="Directory with pandoomain.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    db_dir = Path(args.db_dir).resolve()
+    if not (db_dir / "pandoomain.db").is_file():
+        print(f"WARNING: {db_dir / 'pandoomain.db'} not found", file=sys.stderr)
+
+    handler = partial(RangeHandler, directory=str(BROWSER_DIR), db_dir=db_dir)
+    with ThreadingHTTPServer((args.host, args.port), handler) as server:
+        print(f"Serving http://{args.host}:{args.port}/pandoomain-browser.html")
+        print(f"Databases from {db_dir}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
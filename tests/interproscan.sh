@@ -0,0 +1,47 @@
+#!/usr/bin/env bash
+# Stand-in for interproscan.sh, for testing iscan_pieces.py and
+# iscan_cache.py without InterProScan.
+#
+# Takes the options iscan_pieces.py passes, and writes one made-up
+# Pfam row per protein of --input to -o, in the InterProScan TSV layout.
+#
+# ISCAN_STUB_FAIL: percent of runs that fail, 0 by default.
+
+set -euo pipefail
+
+INPUT=""
+OUTPUT=""
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+    --input | -i) INPUT="$2"; shift 2 ;;
+    -o | --outfile) OUTPUT="$2"; shift 2 ;;
+    --cpu | --tempdir | -f | --formats) shift 2 ;;
+    *) shift ;;
+    esac
+done
+
+if [[ -z "$INPUT" || -z "$OUTPUT" ]]; then
+    echo "interproscan stub: --input and -o are required" >&2
+    exit 2
+fi
+
+if (( RANDOM % 100 < ${ISCAN_STUB_FAIL:-0} )); then
+    echo "interproscan stub: simulated failure" >&2
+    exit 1
+fi
+
+awk -v date="$(date +%d-%m-%Y)" '
+function flush() {
+    if (pid == "") return
+    cmd = "printf %s " seq " | md5sum"
+    cmd | getline md5
+    close(cmd)
+    split(md5, fields, " ")
+    n = length(seq)
+    printf "%s\t%s\t%d\tPfam\tPF00001\tStub domain\t1\t%d\t1.0E-10\tT\t%s\tIPR000001\tStub\t-\t-\n",
+        pid, fields[1], n, n, date
+}
+/^>/ { flush(); pid = substr($1, 2); seq = ""; next }
+{ seq = seq toupper($0) }
+END { flush() }
+' "$INPUT" > "$OUTPUT"
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark a browser database.
+
+Reports the size of the database and of each table, and times the
+queries the browser runs (search, neighborhood, domains, metadata)
+on a sample of neighborhoods. Only the neighbors, iscan and metadata
+names are used, so databases of any layout can be compared.
+When the database has precomputed tiles, the tile lookup and
+decompression are timed too, and with a search index, a ranked
+full-text search of part of a pid and of a product.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import zlib
+from time import perf_counter
+from urllib.parse import quote
+
+QUERIES = {
+    "search": """
+        SELECT genome, nei FROM neighbors WHERE genome = :term
+        UNION
+        SELECT genome, nei FROM neighbors WHERE pid = :term
+        ORDER BY genome, nei
+    """,
+    "neighborhood": """
+        SELECT * FROM neighbors WHERE genome = :genome AND nei = :nei ORDER BY start
+    """,
+    "domains": "SELECT * FROM iscan WHERE pid IN ({pids})",
+    "metadata": "SELECT org, strain FROM metadata WHERE genome = :genome",
+}
+
+TILE_QUERY = """
+    SELECT t.tile FROM tiles t JOIN genomes g USING (genome_id)
+    WHERE g.genome = :genome AND t.nei = :nei
+"""
+
+# First page of the ranked search of pandoomain_browser/api.py
+FULLTEXT_QUERY = """
+    WITH hits AS (
+        SELECT rowid AS tile_id, rank FROM search WHERE search MATCH :match LIMIT 2000
+    )
+    SELECT g.genome, t.nei
+    FROM hits JOIN tiles t USING (tile_id) JOIN genomes g USING (genome_id)
+    ORDER BY hits.rank
+    LIMIT 50
+"""
+
+
+def table_sizes(conn: sqlite3.Connection) -> list:
+    try:
+        return conn.execute(
+            "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return []  # SQLite built without dbstat
+
+
+def sample(conn: sqlite3.Connection, n: int, seed: int) -> list:
+    query = "SELECT DISTINCT genome, nei FROM neighbors"
+    neighborhoods = conn.execute(query).fetchall()
+    random.Random(seed).shuffle(neighborhoods)
+    return neighborhoods[:n]
+
+
+def has_table(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_schema WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def bench(conn: sqlite3.Connection, neighborhoods: list) -> dict:
+    times = {name: 0.0 for name in QUERIES}
+    tiles = has_table(conn, "tiles")
+    if tiles:
+        times["tile"] = 0.0
+    fulltext = has_table(conn, "search")
+    if fulltext:
+        times["fulltext"] = 0.0
+
+    for genome, nei in neighborhoods:
+        start = perf_counter()
+        genes = conn.execute(
+            QUERIES["neighborhood"], {"genome": genome, "nei": nei}
+        ).fetchall()
+        times["neighborhood"] += perf_counter() - start
+
+        pids = [gene[4] for gene in genes if gene[4] is not None]
+
+        start = perf_counter()
+        conn.execute(QUERIES["search"], {"term": genome}).fetchall()
+        if pids:
+            conn.execute(QUERIES["search"], {"term": pids[0]}).fetchall()
+        times["search"] += perf_counter() - start
+
+        start = perf_counter()
+        marks = ", ".join("?" * len(pids))
+        conn.execute(QUERIES["domains"].format(pids=marks), pids).fetchall()
+        times["domains"] += perf_counter() - start
+
+        start = perf_counter()
+        conn.execute(QUERIES["metadata"], {"genome": genome}).fetchall()
+        times["metadata"] += perf_counter() - start
+
+        if tiles:
+            start = perf_counter()
+            (tile,) = conn.execute(
+                TILE_QUERY, {"genome": genome, "nei": nei}
+            ).fetchone()
+            zlib.decompress(tile)
+            times["tile"] += perf_counter() - start
+
+        if fulltext:
+            # A pid prefix and a product, as phrases (substrings)
+            terms = [gene[4][:-3] for gene in genes[:1] if gene[4]]
+            terms += [gene[6] for gene in genes[:1] if gene[6]]
+            start = perf_counter()
+            for term in terms:
+                match = '"{}"'.format(term.replace('"', '""'))
+                conn.execute(FULLTEXT_QUERY, {"match": match}).fetchall()
+            times["fulltext"] += perf_counter() - start
+
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db", nargs="+", help="Browser databases to compare")
+    parser.add_argument("--samples", type=int, default=200, help="Neighborhoods")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for db in args.db:
+        conn = sqlite3.connect(f"file:{quote(db)}?mode=ro", uri=True)
+
+        print(f"{db}: {os.path.getsize(db) / 2**20:.1f} MiB")
+        for name, size in table_sizes(conn):
+            print(f"  {name}\t{size / 2**20:.1f} MiB")
+
+        neighborhoods = sample(conn, args.samples, args.seed)
+        times = bench(conn, neighborhoods)
+
+        print(f"  query\tms_per_neighborhood ({len(neighborhoods)} neighborhoods)")
+        for name, elapsed in times.items():
+            print(f"  {name}\t{1000 * elapsed / max(1, len(neighborhoods)):.3f}")
+
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hmmer.py executors.
+
+Searches the same genomes with every executor of workflow/scripts/hmmer.py
+and reports genomes per second. By default it uses the test queries and
+the genomes downloaded by `make test`.
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import pandas as pd
+
+HMMER_SCRIPT = Path(__file__).parent.parent / "workflow" / "scripts" / "hmmer.py"
+
+
+def load_hmmer():
+    # hmmer.py imports its siblings, as when run by the Snakefile
+    sys.path.insert(0, str(HMMER_SCRIPT.parent))
+    spec = importlib.util.spec_from_file_location("hmmer", HMMER_SCRIPT)
+    hmmer = importlib.util.module_from_spec(spec)
+    sys.modules["hmmer"] = hmmer  # Pool workers unpickle hmmer.run_genome
+    spec.loader.exec_module(hmmer)
+    return hmmer
+
+
+def bench(hmmer, genomes_paths, hmms, cpus, executor, batch_residues):
+    if batch_residues > 0:
+        worker = hmmer.run_batch
+        tasks = hmmer.batch_genomes(genomes_paths, batch_residues)
+    else:
+        worker = hmmer.run_genome
+        tasks = genomes_paths
+
+    start = perf_counter()
+    hits = 0
+    for result in hmmer.search(worker, tasks, hmms, cpus, executor):
+        hits += sum(len(i) for i in result.values())
+    elapsed = perf_counter() - start
+
+    return elapsed, hits
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", default="tests/queries")
+    parser.add_argument("--genomes", default="tests/results/genomes/genomes.tsv")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count())
+    parser.add_argument("--limit", type=int, default=0, help="Use only N genomes")
+    parser.add_argument("--batch-residues", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    hmmer = load_hmmer()
+
+    genomes_paths = list(pd.read_table(args.genomes).faa_path)
+    if args.limit > 0:
+        genomes_paths = genomes_paths[: args.limit]
+    hmms = list(hmmer.get_hmms(args.queries))
+
+    print(
+        f"{len(genomes_paths)} genomes, {len(hmms)} queries, {args.cpus} cpus, "
+        f"batch residues {args.batch_residues}"
+    )
+    print("executor\trun\tseconds\tgenomes_per_sec\thits")
+
+    for executor in hmmer.EXECUTORS:
+        for run in range(1, args.repeat + 1):
+            elapsed, hits = bench(
+                hmmer,
+                genomes_paths,
+                hmms,
+                args.cpus,
+                executor,
+                args.batch_residues,
+            )
+            rate = len(genomes_paths) / elapsed
+            print(f"{executor}\t{run}\t{elapsed:.2f}\t{rate:.2f}\t{hits}")
+
+
+if __name__ == "__main__":
+    main()
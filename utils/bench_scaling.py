@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Benchmark how the pipeline scripts scale with the number of genomes.
+
+Generates synthetic genomes once (see utils/synth_genomes.py) and, for
+each size of --sizes, runs on the first N of them the steps that do not
+need R or InterProScan, as the Snakefile runs them:
+
+    hmmer           hmmer.py
+    cds_tables      cds_table.py build
+    index_proteins  pid_index.py build
+    all_faa         pid_index.py extract, of the synthetic neighbors.tsv
+    split_faa       split_faa.py
+    browser_build   browser_build.py, one database
+    browser_shards  browser_build.py --shards
+
+Every size has its own directory, n{N}, with a genomes directory of
+links to the generated genomes, so nothing is reused between sizes.
+The stage records of the scripts (workflow/scripts/perf.py) go to
+n{N}/stages.jsonl, with the run n{N}-{step}.
+
+Writes scaling.tsv, one row per step and size, with the wall time of
+the stage and of the whole process, CPU time, peak RSS, records,
+records and genomes per second, and the scaling exponent to the
+previous size, log(t2 / t1) / log(n2 / n1): 1 is linear, and a step
+above SUPERLINEAR is flagged. A scaling.tsv of an earlier run is kept
+as scaling.prev.tsv and compared with, like utils/perf_report.py.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import pandas as pd
+
+from synth_genomes import generate
+
+SCRIPTS = Path(__file__).parent.parent / "workflow" / "scripts"
+
+SUPERLINEAR = 1.3  # scaling exponent flagged
+SLOWER = 1.2  # ratio to the previous run flagged as a regression
+MIN_SECONDS = 0.1  # steps faster than this are noise, not compared
+
+
+def step_commands(n_dir: Path, queries: str, cpus: int, shards: int) -> dict:
+    genomes_tsv = n_dir / "genomes" / "genomes.tsv"
+    browser_inputs = [n_dir / "iscan.tsv", n_dir / "genomes_metadata.tsv"]
+    neighbors = n_dir / "neighbors.tsv"
+    index = n_dir / "genomes" / ".pids.db"
+    return {
+        "hmmer": [
+            SCRIPTS / "hmmer.py",
+            "--cpus",
+            cpus,
+            queries,
+            genomes_tsv,
+            n_dir / "hmmer.tsv",
+        ],
+        "cds_tables": [
+            SCRIPTS / "cds_table.py",
+            "build",
+            "--cpus",
+            cpus,
+            genomes_tsv,
+            n_dir / "genomes" / "cds",
+        ],
+        "index_proteins": [
+            SCRIPTS / "pid_index.py",
+            "build",
+            "--cpus",
+            cpus,
+            genomes_tsv,
+            index,
+        ],
+        "all_faa": [
+            SCRIPTS / "pid_index.py",
+            "extract",
+            "--genomes-dir",
+            n_dir / "genomes",
+            index,
+            neighbors,
+        ],
+        "split_faa": [
+            SCRIPTS / "split_faa.py",
+            n_dir / "all.faa",
+            n_dir / ".pieces_faa",
+            n_dir / ".pieces_faa" / "split_faa.sentinel",
+        ],
+        "browser_build": [
+            SCRIPTS / "browser_build.py",
+            *browser_inputs,
+            neighbors,
+            n_dir / "browser" / "pandoomain.db",
+            "--jobs",
+            cpus,
+        ],
+        "browser_shards": [
+            SCRIPTS / "browser_build.py",
+            *browser_inputs,
+            neighbors,
+            n_dir / "shards" / "pandoomain.db",
+            "--shards",
+            shards,
+            "--jobs",
+            cpus,
+        ],
+    }
+
+
+def subset(synth_dir: Path, n_dir: Path, n: int) -> None:
+    """
+    The first n genomes of synth_dir, and their tables, in n_dir.
+    """
+    if n_dir.exists():
+        shutil.rmtree(n_dir)
+    genomes_dir = n_dir / "genomes"
+    genomes_dir.mkdir(parents=True)
+
+    genomes = pd.read_table(synth_dir / "genomes" / "genomes.tsv").iloc[:n]
+    for genome in genomes.genome:
+        (genomes_dir / genome).symlink_to((synth_dir / "genomes" / genome).resolve())
+    genomes["faa_path"] = [
+        str(genomes_dir / genome / f"{genome}.faa") for genome in genomes.genome
+    ]
+    genomes.to_csv(genomes_dir / "genomes.tsv", sep="\t", index=False)
+
+    keep = set(genomes.genome)
+    metadata = pd.read_table(synth_dir / "genomes_metadata.tsv")
+    metadata[metadata.genome.isin(keep)].to_csv(
+        n_dir / "genomes_metadata.tsv", sep="\t", index=False
+    )
+    neighbors = pd.read_table(synth_dir / "neighbors.tsv")
+    neighbors = neighbors[neighbors.genome.isin(keep)]
+    neighbors.to_csv(n_dir / "neighbors.tsv", sep="\t", index=False)
+    iscan = pd.read_table(synth_dir / "iscan.tsv")
+    iscan[iscan.pid.isin(set(neighbors.pid))].to_csv(
+        n_dir / "iscan.tsv", sep="\t", index=False
+    )
+
+
+def run_step(n_dir: Path, step: str, cmd: list) -> dict:
+    env = dict(os.environ)
+    env["PANDOOMAIN_PERF"] = str((n_dir / "stages.jsonl").resolve())
+    env["PANDOOMAIN_RUN"] = f"{n_dir.name}-{step}"
+    # The scripts import their siblings, as when run by the Snakefile
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(SCRIPTS), env.get("PYTHONPATH")])
+    )
+
+    stdout = subprocess.DEVNULL
+    if step == "all_faa":
+        stdout = open(n_dir / "all.faa", "w")
+    start = perf_counter()
+    with open(n_dir / f"{step}.log", "w") as log:
+        done = subprocess.run(
+            [sys.executable, *map(str, cmd)], stdout=stdout, stderr=log, env=env
+        )
+    wall = perf_counter() - start
+    if stdout is not subprocess.DEVNULL:
+        stdout.close()
+    if done.returncode != 0:
+        sys.exit(f"{step} failed, see {n_dir / f'{step}.log'}")
+
+    # The stage excludes the interpreter start and the imports
+    row = {"step": step, "wall_s": wall, "process_s": wall}
+    with open(n_dir / "stages.jsonl") as h:
+        for line in h:
+            record = json.loads(line)
+            if record.get("kind") == "stage" and record["run"] == env["PANDOOMAIN_RUN"]:
+                for col in ("wall_s", "cpu_s", "max_rss_mb", "records"):
+                    row[col] = record[col]
+    return row
+
+
+def exponents(table: pd.DataFrame) -> pd.Series:
+    """
+    Scaling exponent of each row to the previous size of its step.
+    """
+    result = pd.Series(float("nan"), index=table.index)
+    for _, rows in table.groupby("step", sort=False):
+        rows = rows.sort_values("genomes")
+        pairs = zip(rows.iloc[:-1].iterrows(), rows.iloc[1:].iterrows())
+        for (_, prev), (i, row) in pairs:
+            if prev["wall_s"] < MIN_SECONDS or row["genomes"] == prev["genomes"]:
+                continue
+            result[i] = math.log(row["wall_s"] / prev["wall_s"]) / math.log(
+                row["genomes"] / prev["genomes"]
+            )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("work_dir", help="Directory for the genomes and the runs")
+    parser.add_argument(
+        "--sizes", default="10,100,1000,10000", help="Comma separated genome counts"
+    )
+    parser.add_argument("--queries", default="tests/queries")
+    parser.add_argument(
+        "--proteins", type=int, default=500, help="Median proteins per genome"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cpus", type=int, default=os.cpu_count())
+    parser.add_argument("--shards", type=int, default=4, help="For browser_shards")
+    parser.add_argument(
+        "--steps", help="Comma separated steps to run, all of them by default"
+    )
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    work_dir = Path(args.work_dir)
+    synth_dir = work_dir / "synthetic"
+
+    # Genome i depends only on the seed and i, so the largest size is
+    # generated once, and again only when the parameters change
+    params = {"genomes": sizes[-1], "proteins": args.proteins, "seed": args.seed}
+    params_json = synth_dir / "params.json"
+    if not params_json.exists() or json.loads(params_json.read_text()) != params:
+        if synth_dir.exists():
+            shutil.rmtree(synth_dir)
+        generate(synth_dir, sizes[-1], Path(args.queries), args.proteins, args.seed)
+        params_json.write_text(json.dumps(params))
+
+    rows = []
+    for n in sizes:
+        n_dir = work_dir / f"n{n}"
+        subset(synth_dir, n_dir, n)
+        steps = step_commands(n_dir, args.queries, args.cpus, args.shards)
+        if args.steps:
+            steps = {step: steps[step] for step in args.steps.split(",")}
+        for step, cmd in steps.items():
+            row = run_step(n_dir, step, cmd)
+            row["genomes"] = n
+            row["records_per_s"] = row.get("records", 0) / max(row["wall_s"], 1e-3)
+            row["genomes_per_s"] = n / max(row["wall_s"], 1e-3)
+            rows.append(row)
+            print(f"  {n} genomes\t{step}\t{row['wall_s']:.2f}s", file=sys.stderr)
+
+    table = pd.DataFrame(rows)
+    table = table[
+        ["step", "genomes", "wall_s", "process_s", "cpu_s", "max_rss_mb"]
+        + ["records", "records_per_s", "genomes_per_s"]
+    ]
+    table["exponent"] = exponents(table)
+
+    scaling_tsv = work_dir / "scaling.tsv"
+    table["wall_vs_prev"] = float("nan")
+    if scaling_tsv.exists():
+        prev_tsv = work_dir / "scaling.prev.tsv"
+        os.replace(scaling_tsv, prev_tsv)
+        prev = pd.read_table(prev_tsv).set_index(["step", "genomes"]).wall_s
+        for i, row in table.iterrows():
+            last = prev.get((row["step"], row["genomes"]))
+            if last is not None and last >= MIN_SECONDS:
+                table.loc[i, "wall_vs_prev"] = row["wall_s"] / last
+    table.to_csv(scaling_tsv, sep="\t", index=False, float_format="%.3f")
+
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(table.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+
+    for row in table[table.exponent > SUPERLINEAR].itertuples():
+        print(
+            f"\nSUPERLINEAR? {row.step} scales as n^{row.exponent:.2f} "
+            f"up to {row.genomes} genomes."
+        )
+    for row in table[table.wall_vs_prev > SLOWER].itertuples():
+        print(
+            f"\nREGRESSION? {row.step} took {row.wall_vs_prev:.2f}x its last run "
+            f"on {row.genomes} genomes."
+        )
+
+    print(f"\nWrote {scaling_tsv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Merge the performance records of a pipeline run into one table.
+
+Reads, from {results}/benchmarks:
+
+    {rule}.tsv      Snakemake benchmark: of each rule (wall and CPU time,
+                    peak RSS, I/O)
+    stages.jsonl    the records of the Python stages (workflow/scripts/perf.py):
+                    records per second and the slowest items of each stage
+
+and writes report.tsv with one row per rule, its latest measurement.
+Each measurement is also appended once to history.tsv, and a rule is
+compared with its previous measurement there (wall_vs_prev, rss_vs_prev),
+so a regression shows up as a ratio above 1 on the next run.
+Slow items (a genome stalling the hmmer pool, an InterProScan piece)
+of the reported stages are listed after the table.
+"""
+
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# Snakemake benchmark column -> report column
+BENCHMARK_COLUMNS = {
+    "s": "wall_s",
+    "cpu_time": "cpu_s",
+    "max_rss": "max_rss_mb",
+    "io_in": "io_in_mb",
+    "io_out": "io_out_mb",
+    "mean_load": "mean_load",
+}
+STAGE_COLUMNS = ["records", "records_per_s", "items", "item_max_s", "run"]
+SLOWER = 1.2  # ratio to the previous measurement flagged as a regression
+
+
+def read_benchmarks(bench_dir: Path) -> pd.DataFrame:
+    rows = []
+    for path in sorted(bench_dir.glob("*.tsv")):
+        if path.name in ("report.tsv", "history.tsv"):
+            continue
+        bench = pd.read_table(path)
+        if bench.empty or "s" not in bench:
+            continue
+        # Several lines with snakemake --benchmark-repeats, keep the median
+        bench = bench.apply(pd.to_numeric, errors="coerce").median()
+        finished = datetime.fromtimestamp(path.stat().st_mtime)
+        row = {"rule": path.stem, "finished": finished.isoformat(timespec="seconds")}
+        for col, name in BENCHMARK_COLUMNS.items():
+            row[name] = bench.get(col, float("nan"))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["rule", "finished", *BENCHMARK_COLUMNS.values()])
+
+
+def read_stages(path: Path):
+    """
+    Latest stage line of each stage, and all the outlier lines.
+    """
+    stages, outliers = {}, []
+    if not path.exists():
+        return stages, outliers
+    with open(path) as h:
+        for line in h:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # torn by a killed job
+                continue
+            if record.get("kind") == "stage":
+                stages[record["stage"]] = record
+            elif record.get("kind") == "outlier":
+                outliers.append(record)
+    return stages, outliers
+
+
+def compare(report: pd.DataFrame, history: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ratio of each rule to its previous measurement in history.
+    """
+    report = report.copy()
+    report["wall_vs_prev"] = float("nan")
+    report["rss_vs_prev"] = float("nan")
+    if history.empty:
+        return report
+
+    for i, row in report.iterrows():
+        previous = history[
+            (history["rule"] == row["rule"]) & (history["finished"] < row["finished"])
+        ]
+        if previous.empty:
+            continue
+        last = previous.iloc[-1]
+        if last["wall_s"] > 0:
+            report.loc[i, "wall_vs_prev"] = row["wall_s"] / last["wall_s"]
+        if last["max_rss_mb"] > 0:
+            report.loc[i, "rss_vs_prev"] = row["max_rss_mb"] / last["max_rss_mb"]
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("bench_dir", help="{results}/benchmarks")
+    parser.add_argument(
+        "--no-history", action="store_true", help="Do not append to history.tsv"
+    )
+    args = parser.parse_args()
+
+    bench_dir = Path(args.bench_dir)
+    report = read_benchmarks(bench_dir)
+    if report.empty:
+        print(f"No Snakemake benchmark files in {bench_dir}, run the pipeline first.")
+        return
+
+    stages, outliers = read_stages(bench_dir / "stages.jsonl")
+    for col in STAGE_COLUMNS:
+        report[col] = [stages.get(rule, {}).get(col) for rule in report["rule"]]
+    report = report.sort_values("finished", kind="stable").reset_index(drop=True)
+
+    history_tsv = bench_dir / "history.tsv"
+    history = pd.read_table(history_tsv) if history_tsv.exists() else report.iloc[:0]
+    report = compare(report, history)
+
+    if not args.no_history:
+        seen = set(zip(history["rule"], history["finished"]))
+        new = report[
+            [(r, f) not in seen for r, f in zip(report["rule"], report["finished"])]
+        ]
+        new[history.columns if not history.empty else report.columns].to_csv(
+            history_tsv,
+            sep="\t",
+            index=False,
+            mode="a",
+            header=not history_tsv.exists(),
+        )
+
+    report.to_csv(bench_dir / "report.tsv", sep="\t", index=False, float_format="%.3f")
+
+    shown = report.drop(columns=["io_in_mb", "io_out_mb"])
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(shown.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+
+    slower = report[report["wall_vs_prev"] > SLOWER]
+    for row in slower.itertuples():
+        print(f"\nREGRESSION? {row.rule} took {row.wall_vs_prev:.2f}x its last run.")
+
+    runs = {stages[rule].get("run") for rule in report["rule"] if rule in stages}
+    current = [o for o in outliers if o.get("run") in runs]
+    if current:
+        print("\nSlow items, against the median item of their stage:")
+        for o in sorted(current, key=lambda o: -o["seconds"]):
+            print(
+                f"  {o['stage']}\t{o['item']}\t{o['seconds']:.1f}s\t"
+                f"median {o['median_s']:.2f}s"
+            )
+
+    print(f"\nWrote {bench_dir / 'report.tsv'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+Write synthetic genome assemblies for offline tests and benchmarks.
+
+    utils/synth_genomes.py tests/synthetic 100
+
+fills OUT_DIR like a pipeline results directory:
+
+    genomes.txt                      the accessions, an input genome list
+    genomes/{genome}/{genome}.faa    proteome
+    genomes/{genome}/{genome}.gff    NCBI-style GFF3 (region, gene, CDS)
+    genomes/genomes.tsv              as written by hydrate.py
+    genomes_metadata.tsv             genome, tax_id, org, genus, strain
+    neighbors.tsv                    the neighborhoods of the seeded hits
+    iscan.tsv                        made-up Pfam domains of their proteins
+
+Proteins are random sequences with bacterial amino acid frequencies and
+log-normal lengths, on 1 to 3 contigs per genome, on both strands, with
+a few pseudogenes (in the GFF, not the .faa). A share of them comes from
+a pool common to all genomes, with the same WP_ accession everywhere,
+like RefSeq non-redundant proteins.
+
+Some proteins are seeded to hit the profiles of --queries: the consensus
+of a profile, with a few positions sampled from its match emissions,
+between random flanks. Each genome carries each query with probability
+--hit-rate. neighbors.tsv and iscan.tsv are what neighbors.R and
+InterProScan would give for those hits, so the browser builders can run
+without R or InterProScan.
+
+Genome i depends only on --seed and i, so a run with more genomes
+extends a smaller one, and its first N genomes are the smaller set.
+"""
+
+import argparse
+import math
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+AMINO = "ACDEFGHIKLMNPQRSTVWY"
+# Amino acid frequencies of bacterial proteomes, in the order of AMINO
+FREQS = np.array(
+    [
+        0.095, 0.011, 0.052, 0.058, 0.039, 0.074, 0.022, 0.060, 0.044, 0.104,
+        0.025, 0.039, 0.044, 0.044, 0.055, 0.058, 0.053, 0.071, 0.013, 0.029,
+    ]
+)  # fmt: skip
+FREQS = FREQS / FREQS.sum()
+
+GENOME_BASE = 900_000_000  # GCF_900000000.1 onwards
+SHARED_BASE = 900_000_000  # WP_ accessions of the shared pool
+UNIQUE_BASE = 10**9  # WP_ accessions unique to a genome, past the real ones
+UNIQUE_STRIDE = 10**5  # of accessions per genome
+FAA_WIDTH = 80
+N_NEIGHBORS = 12  # as the default n_neighbors of workflow/rules/globals.smk
+
+GENERA = [
+    "Escherichia",
+    "Pseudomonas",
+    "Bacillus",
+    "Streptomyces",
+    "Vibrio",
+    "Salmonella",
+    "Klebsiella",
+    "Burkholderia",
+    "Acinetobacter",
+    "Clostridioides",
+]
+PRODUCTS = [
+    "hypothetical protein",
+    "ABC transporter ATP-binding protein",
+    "MFS transporter",
+    "LysR family transcriptional regulator",
+    "response regulator transcription factor",
+    "DNA-binding protein",
+    "GNAT family N-acetyltransferase",
+    "SDR family oxidoreductase",
+    "glycosyltransferase family 2 protein",
+    "TonB-dependent receptor",
+    "alpha/beta hydrolase",
+    "sigma-70 family RNA polymerase sigma factor",
+]
+GENE_NAMES = ["dnaA", "recA", "gyrB", "rpoB", "ftsZ", "secA", "groL", "tufA"]
+
+
+class Profile(NamedTuple):
+    accession: str
+    name: str
+    desc: str
+    consensus: str
+    emissions: np.ndarray  # match state probabilities, one row per node
+
+
+class Protein(NamedTuple):
+    pid: str
+    seq: str
+    product: str
+    gene: str
+    queries: Tuple[str, ...]  # seeded profiles
+
+
+def read_profiles(queries_dir: Path) -> List[Profile]:
+    """
+    Accession, name, consensus and match emissions of HMMER3 profiles.
+    """
+    profiles = []
+    for path in sorted(queries_dir.glob("*.hmm")):
+        fields: Dict[str, str] = {}
+        consensus, emissions = [], []
+        in_model = False
+        with open(path) as h:
+            for line in h:
+                if line.startswith("//"):
+                    profiles.append(
+                        Profile(
+                            fields.get("ACC", fields.get("NAME", path.stem)),
+                            fields.get("NAME", path.stem),
+                            fields.get("DESC", ""),
+                            "".join(consensus),
+                            np.array(emissions),
+                        )
+                    )
+                    fields, consensus, emissions = {}, [], []
+                    in_model = False
+                elif line.startswith("HMM "):
+                    in_model = True
+                elif not in_model:
+                    key, _, value = line.partition(" ")
+                    fields.setdefault(key, value.strip())
+                else:
+                    cols = line.split()
+                    # Match emission line: node, 20 scores, MAP, CONS, RF, MM, CS
+                    if len(cols) == 26 and cols[0].isdigit():
+                        scores = np.array([float(x) for x in cols[1:21]])
+                        probs = np.exp(-scores)
+                        emissions.append(probs / probs.sum())
+                        consensus.append(cols[22].upper())
+    return profiles
+
+
+def random_seq(rng: np.random.Generator, length: int) -> str:
+    residues = rng.choice(len(AMINO), size=length, p=FREQS)
+    return "M" + "".join(AMINO[i] for i in residues[1:])
+
+
+def random_length(rng: np.random.Generator) -> int:
+    return int(min(1500, max(50, rng.lognormal(math.log(280), 0.5))))
+
+
+def seeded_seq(rng: np.random.Generator, profile: Profile, mutation: float) -> str:
+    """
+    The consensus of a profile between random flanks, with a share of
+    its positions sampled from the match emissions.
+    """
+    core = list(profile.consensus)
+    for node in np.flatnonzero(rng.random(len(core)) < mutation):
+        core[node] = AMINO[rng.choice(len(AMINO), p=profile.emissions[node])]
+    left = random_seq(rng, int(rng.integers(10, 60)))
+    right = random_seq(rng, int(rng.integers(10, 60)))[1:]
+    return left + "".join(core) + right
+
+
+def shared_pool(seed: int, size: int) -> List[Protein]:
+    rng = np.random.default_rng([seed, 0])
+    return [
+        Protein(
+            f"WP_{SHARED_BASE + i:09d}.1",
+            random_seq(rng, random_length(rng)),
+            PRODUCTS[int(rng.integers(len(PRODUCTS)))],
+            (
+                GENE_NAMES[int(rng.integers(len(GENE_NAMES)))]
+                if rng.random() < 0.3
+                else ""
+            ),
+            (),
+        )
+        for i in range(size)
+    ]
+
+
+def genome_accession(i: int) -> str:
+    return f"GCF_{GENOME_BASE + i:09d}.1"
+
+
+def locus_prefix(genome: str) -> str:
+    return f"SYN{genome[4:13]}"
+
+
+def feature(contig, start, end, strand, locus, protein) -> dict:
+    return dict(
+        contig=contig,
+        start=start,
+        end=end,
+        strand=strand,
+        locus=locus,
+        protein=protein,
+    )
+
+
+def make_proteome(
+    i: int,
+    seed: int,
+    n_proteins: int,
+    pool: List[Protein],
+    shared: float,
+    profiles: List[Profile],
+    hit_rate: float,
+    mutation: float,
+) -> List[Protein]:
+    rng = np.random.default_rng([seed, 1, i])
+    # Proteome sizes vary between genomes, a few are much larger
+    n = min(UNIQUE_STRIDE // 2, max(20, int(n_proteins * rng.lognormal(0, 0.3))))
+
+    proteins = []
+    n_shared = min(len(pool), int(n * shared))
+    for j in rng.choice(len(pool), size=n_shared, replace=False):
+        proteins.append(pool[j])
+
+    first = UNIQUE_BASE + i * UNIQUE_STRIDE
+    for j in range(n - n_shared):
+        proteins.append(
+            Protein(
+                f"WP_{first + j}.1",
+                random_seq(rng, random_length(rng)),
+                PRODUCTS[int(rng.integers(len(PRODUCTS)))],
+                "",
+                (),
+            )
+        )
+
+    for k, profile in enumerate(profiles):
+        if rng.random() < hit_rate:
+            proteins.append(
+                Protein(
+                    f"WP_{first + UNIQUE_STRIDE - 1 - k}.1",
+                    seeded_seq(rng, profile, mutation),
+                    f"{profile.desc}-containing protein",
+                    "",
+                    (profile.accession,),
+                )
+            )
+
+    order = rng.permutation(len(proteins))
+    return [proteins[j] for j in order]
+
+
+def layout(
+    i: int, seed: int, proteins: List[Protein]
+) -> Tuple[List[dict], Dict[str, int]]:
+    """
+    Place the proteins on contigs as CDS, with some pseudogenes.
+
+    Returns:
+        One dict per feature, and the length of each contig.
+    """
+    rng = np.random.default_rng([seed, 2, i])
+    n_contigs = int(rng.integers(1, 4))
+    contig_names = [f"NZ_SYN{i:07d}{c + 1:02d}.1" for c in range(n_contigs)]
+    # Most genes on the chromosome, the rest on plasmids
+    weights = np.array([8, 1, 1][:n_contigs])
+    contig_of = rng.choice(n_contigs, size=len(proteins), p=weights / weights.sum())
+
+    features = []
+    ends = {name: 0 for name in contig_names}
+    locus = 0
+    for protein, c in zip(proteins, contig_of):
+        contig = contig_names[c]
+        if rng.random() < 0.01:
+            start = ends[contig] + int(rng.integers(50, 300))
+            end = start + int(rng.integers(100, 900))
+            locus += 5
+            features.append(feature(contig, start, end, "+", locus, None))
+            ends[contig] = end
+        start = ends[contig] + int(rng.integers(20, 300))
+        end = start + 3 * len(protein.seq) + 2  # with the stop codon
+        locus += 5
+        strand = "+" if rng.random() < 0.5 else "-"
+        features.append(feature(contig, start, end, strand, locus, protein))
+        ends[contig] = end
+
+    lengths = {name: end + int(rng.integers(100, 1000)) for name, end in ends.items()}
+    return features, lengths
+
+
+def write_faa(path: Path, proteins: List[Protein]) -> None:
+    with open(path, "w") as h:
+        for protein in proteins:
+            h.write(f">{protein.pid} {protein.product} [synthetic]\n")
+            for k in range(0, len(protein.seq), FAA_WIDTH):
+                h.write(protein.seq[k : k + FAA_WIDTH] + "\n")
+
+
+def write_gff(
+    path: Path, genome: str, features: List[dict], lengths: Dict[str, int]
+) -> None:
+    prefix = locus_prefix(genome)
+    with open(path, "w") as h:
+        h.write("##gff-version 3\n#!gff-spec-version 1.21\n")
+        h.write(f"#!genome-build {genome}\n")
+        for contig, length in lengths.items():
+            h.write(f"##sequence-region {contig} 1 {length}\n")
+        for contig, length in lengths.items():
+            h.write(
+                f"{contig}\tRefSeq\tregion\t1\t{length}\t.\t+\t.\t"
+                f"ID={contig}:1..{length};Dbxref=taxon:0;gbkey=Src;"
+                "mol_type=genomic DNA\n"
+            )
+            for f in (f for f in features if f["contig"] == contig):
+                locus_tag = f"{prefix}_{f['locus']:05d}"
+                protein = f["protein"]
+                coords = (
+                    f"{contig}\tRefSeq\t{{}}\t{f['start']}\t{f['end']}\t.\t"
+                    f"{f['strand']}"
+                )
+                if protein is None:
+                    h.write(
+                        coords.format("pseudogene") + "\t.\t"
+                        f"ID=gene-{locus_tag};Name={locus_tag};gbkey=Gene;"
+                        f"gene_biotype=pseudogene;locus_tag={locus_tag};pseudo=true\n"
+                    )
+                    h.write(
+                        coords.format("CDS") + "\t0\t"
+                        f"ID=cds-{locus_tag};Parent=gene-{locus_tag};gbkey=CDS;"
+                        f"locus_tag={locus_tag};product=IS element transposase;"
+                        "pseudo=true;transl_table=11\n"
+                    )
+                    continue
+                gene = f"gene={protein.gene};" if protein.gene else ""
+                h.write(
+                    coords.format("gene") + "\t.\t"
+                    f"ID=gene-{locus_tag};Name={protein.gene or locus_tag};gbkey=Gene;"
+                    f"{gene}gene_biotype=protein_coding;locus_tag={locus_tag}\n"
+                )
+                product = protein.product.replace(",", "%2C").replace(";", "%3B")
+                h.write(
+                    coords.format("CDS") + "\t0\t"
+                    f"ID=cds-{protein.pid};Parent=gene-{locus_tag};"
+                    f"Dbxref=GenBank:{protein.pid};Name={protein.pid};gbkey=CDS;{gene}"
+                    f"locus_tag={locus_tag};product={product};"
+                    f"protein_id={protein.pid};transl_table=11\n"
+                )
+
+
+def neighborhoods(genome: str, features: List[dict], n: int) -> List[dict]:
+    """
+    Rows of neighbors.tsv for the seeded proteins, as neighbors.R makes them.
+    """
+    rows = []
+    # Without pseudogenes, ordered by start on each contig
+    genes = sorted(
+        (f for f in features if f["protein"] is not None),
+        key=lambda f: (f["contig"], f["start"]),
+    )
+    order, last = 0, None
+    for f in genes:
+        order = order + 1 if f["contig"] == last else 1
+        last = f["contig"]
+        f["order"] = order
+
+    neid = 0
+    for row, f in enumerate(genes):
+        if not f["protein"].queries:
+            continue
+        neid += 1
+        queries = ",".join(f["protein"].queries)
+        for other in range(max(0, row - n), min(len(genes), row + n + 1)):
+            g = genes[other]
+            if g["contig"] != f["contig"]:
+                continue
+            rows.append(
+                {
+                    "genome": genome,
+                    "neid": neid,
+                    "neoff": other - row,
+                    "order": g["order"],
+                    "pid": g["protein"].pid,
+                    "gene": g["protein"].gene or "NA",
+                    "product": g["protein"].product,
+                    "start": g["start"],
+                    "end": g["end"],
+                    "strand": g["strand"],
+                    "frame": 0,
+                    "locus_tag": f"{locus_prefix(genome)}_{g['locus']:05d}",
+                    "contig": g["contig"],
+                    "queries": queries,
+                }
+            )
+    return rows
+
+
+def domains(protein: Protein, profiles: Dict[str, Profile], rng) -> List[tuple]:
+    """
+    Rows of iscan.tsv for a protein: its seeded profile, and maybe others.
+    """
+    length = len(protein.seq)
+    rows = []
+    for accession in protein.queries:
+        profile = profiles[accession]
+        start = protein.seq.find(profile.consensus[:5]) + 1 or 1
+        end = min(length, start + len(profile.consensus) - 1)
+        pfam = accession.split(".")[0]
+        rows.append((start, end, pfam, profile.desc))
+    for _ in range(int(rng.integers(0, 3))):
+        start = int(rng.integers(1, max(2, length - 40)))
+        end = min(length, start + int(rng.integers(30, 200)))
+        family = int(rng.integers(1, 2000))
+        desc = f"Synthetic domain family {family}"
+        rows.append((start, end, f"PF9{family:04d}", desc))
+    return [
+        (
+            protein.pid,
+            start,
+            end,
+            length,
+            "Pfam",
+            f"IPR9{pfam[3:]}",
+            desc,
+            pfam,
+            desc,
+        )
+        for start, end, pfam, desc in sorted(rows)
+    ]
+
+
+def generate(
+    out_dir: Path,
+    n_genomes: int,
+    queries_dir: Optional[Path],
+    n_proteins: int = 3000,
+    seed: int = 42,
+    shared: float = 0.3,
+    hit_rate: float = 0.3,
+    mutation: float = 0.1,
+    n_neighbors: int = N_NEIGHBORS,
+) -> None:
+    profiles = read_profiles(queries_dir) if queries_dir is not None else []
+    by_accession = {profile.accession: profile for profile in profiles}
+    pool = shared_pool(seed, max(1, int(n_proteins * shared * 2)))
+
+    genomes_dir = out_dir / "genomes"
+    genomes_dir.mkdir(parents=True, exist_ok=True)
+
+    genomes = [genome_accession(i) for i in range(n_genomes)]
+    with open(out_dir / "genomes.txt", "w") as h:
+        h.writelines(f"{genome}\n" for genome in genomes)
+
+    neighbors_cols = None
+    iscan_pids = set()
+    with (
+        open(genomes_dir / "genomes.tsv", "w") as h_genomes,
+        open(out_dir / "genomes_metadata.tsv", "w") as h_meta,
+        open(out_dir / "neighbors.tsv", "w") as h_neighbors,
+        open(out_dir / "iscan.tsv", "w") as h_iscan,
+    ):
+        h_genomes.write("id\tgenome\trefseq\tversion\tfaa_path\n")
+        h_meta.write("genome\ttax_id\torg\tgenus\tstrain\n")
+        h_iscan.write(
+            "pid\tstart\tend\tlength\tanalysis\tinterpro\tinterpro_txt\t"
+            "memberDB\tmemberDB_txt\n"
+        )
+
+        for i, genome in enumerate(genomes):
+            proteins = make_proteome(
+                i, seed, n_proteins, pool, shared, profiles, hit_rate, mutation
+            )
+            features, lengths = layout(i, seed, proteins)
+
+            genome_dir = genomes_dir / genome
+            genome_dir.mkdir(exist_ok=True)
+            faa = genome_dir / f"{genome}.faa"
+            write_faa(faa, proteins)
+            write_gff(genome_dir / f"{genome}.gff", genome, features, lengths)
+
+            h_genomes.write(f"{GENOME_BASE + i}\t{genome}\tTrue\t1\t{faa}\n")
+            genus = GENERA[i % len(GENERA)]
+            h_meta.write(
+                f"{genome}\t{100_000 + i}\t{genus} synthetica {i}\t{genus}\tSYN-{i}\n"
+            )
+
+            rows = neighborhoods(genome, features, n_neighbors)
+            if neighbors_cols is None and rows:
+                neighbors_cols = list(rows[0])
+                h_neighbors.write("\t".join(neighbors_cols) + "\n")
+            for row in rows:
+                values = (str(row[col]) for col in neighbors_cols)
+                h_neighbors.write("\t".join(values) + "\n")
+
+            rng = np.random.default_rng([seed, 3, i])
+            by_pid = {protein.pid: protein for protein in proteins}
+            for pid in dict.fromkeys(row["pid"] for row in rows):
+                if pid in iscan_pids:  # shared proteins once
+                    continue
+                iscan_pids.add(pid)
+                for domain in domains(by_pid[pid], by_accession, rng):
+                    h_iscan.write("\t".join(map(str, domain)) + "\n")
+
+            print(f"  {i + 1}/{n_genomes} genomes", end="\r", file=sys.stderr)
+
+    print(f"\nWrote {n_genomes} genomes to {genomes_dir}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("out_dir", help="Results directory to fill")
+    parser.add_argument("genomes", type=int, help="Number of genomes")
+    parser.add_argument(
+        "--queries", default="tests/queries", help="Profiles to seed hits of"
+    )
+    parser.add_argument(
+        "--proteins", type=int, default=3000, help="Median proteins per genome"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--shared", type=float, default=0.3, help="Share of proteins from a common pool"
+    )
+    parser.add_argument(
+        "--hit-rate", type=float, default=0.3, help="Chance of each query per genome"
+    )
+    parser.add_argument(
+        "--mutation", type=float, default=0.1, help="Share of seeded positions sampled"
+    )
+    parser.add_argument("--neighbors", type=int, default=N_NEIGHBORS)
+    args = parser.parse_args()
+
+    generate(
+        Path(args.out_dir),
+        args.genomes,
+        Path(args.queries) if args.queries else None,
+        args.proteins,
+        args.seed,
+        args.shared,
+        args.hit_rate,
+        args.mutation,
+        args.neighbors,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ rule get_metadata_raw:
         in_genomes=IN_GENOMES,
     output:
         metadata_raw=f"{RESULTS}/.genomes_metadata_raw.tsv",
+    benchmark:
+        f"{BENCHMARKS}/get_metadata_raw.tsv"
     cache: True
     shell:
         """
@@ -27,6 +29,8 @@ rule get_metadata:
         metadata_raw=rules.get_metadata_raw.output,
     output:
         metadata=f"{RESULTS}/genomes_metadata.tsv",
+    benchmark:
+        f"{BENCHMARKS}/get_metadata.tsv"
     shell:
         """
 workflow/scripts/genome_metadata.R {input} >| {output}
@@ -43,12 +47,52 @@ rule download_genomes:
     output:
         genomes=f"{RESULTS}/genomes/genomes.tsv",
         not_found=f"{RESULTS}/genomes/not_found.tsv",
+    benchmark:
+        f"{BENCHMARKS}/download_genomes.tsv"
     threads: workflow.cores
     params:
         genomes_dir=get_genomes_dir,
     shell:
         """
-workflow/scripts/hydrate.py {threads} {params} {input}
+workflow/scripts/hydrate.py {threads} {params} {input} {STORE_FLAG}
+"""
+
+
+rule index_proteins:
+    input:
+        genomes=rules.download_genomes.output.genomes,
+    output:
+        sentinel=f"{RESULTS}/genomes/.pids_index.sentinel",
+    benchmark:
+        f"{BENCHMARKS}/index_proteins.tsv"
+    threads: workflow.cores
+    params:
+        # Updated in place, so it is not an output
+        index=f"{RESULTS}/genomes/.pids.db",
+        store=f"--store {STORE_DIR}" if GENOME_STORE else "",
+    shell:
+        """
+workflow/scripts/pid_index.py {params.store} build --cpus {threads} {input} {params.index}
+date >| {output}
+"""
+
+
+rule cds_tables:
+    input:
+        genomes=rules.download_genomes.output.genomes,
+    output:
+        sentinel=f"{RESULTS}/genomes/.cds.sentinel",
+    benchmark:
+        f"{BENCHMARKS}/cds_tables.tsv"
+    threads: workflow.cores
+    params:
+        # Updated in place, so it is not an output
+        cds_dir=f"{RESULTS}/genomes/cds",
+        store=f"--store {STORE_DIR}" if GENOME_STORE else "",
+    shell:
+        """
+workflow/scripts/cds_table.py {params.store} build --cpus {threads} {input} {params.cds_dir}
+date >| {output}
 """
 
 
@@ -62,6 +106,8 @@ def params_output_name(wc, output):
 rule taxallnomy_targz:
     output:
         tar_gz=f"{RESULTS}/taxallnomy.tar.gz",
+    benchmark:
+        f"{BENCHMARKS}/taxallnomy_targz.tsv"
     cache: True
     params:
         url="https://sourceforge.net/projects/taxallnomy/files/latest/download",
@@ -88,6 +134,8 @@ rule taxallnomy_linname:
         tar_gz=rules.taxallnomy_targz.output,
     output:
         taxallnomy=f"{RESULTS}/taxallnomy_lin_name.tsv",
+    benchmark:
+        f"{BENCHMARKS}/taxallnomy_linname.tsv"
     cache: True
     params:
         ori=f"{RESULTS}/taxallnomy_database/taxallnomy_lin_name.tab",
@@ -104,6 +152,8 @@ rule join_genomes_taxallnomy:
         genomes=rules.get_metadata.output,
     output:
         ranks=f"{RESULTS}/genomes_ranks.tsv",
+    benchmark:
+        f"{BENCHMARKS}/join_genomes_taxallnomy.tsv"
     cache: True
     shell:
         """
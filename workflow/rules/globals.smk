@@ -1,3 +1,5 @@
+import os
+from datetime import datetime
 from pathlib import Path
 
 
@@ -32,6 +34,34 @@ RESULTS = Path(config.setdefault("results", "results"))
 N_NEIGHBORS = int(config.setdefault("n_neighbors", 12))
 BATCH_SIZE = int(config.setdefault("batch_size", 8000))
 FAA_WIDTH = int(config.setdefault("faa_width", 80))
+BALANCE_PIECES = bool(config.setdefault("balance_pieces", False))
+HMMER_BATCH_RESIDUES = int(config.setdefault("hmmer_batch_residues", 0))
+HMMER_EXECUTOR = str(config.setdefault("hmmer_executor", "process"))
+
+GENOME_STORE = bool(config.setdefault("genome_store", False))
+STORE_FLAG = "--store" if GENOME_STORE else ""
+STORE_DIR = RESULTS / "genomes" / "store"
+
+# Shared across runs when set to a path outside results
+ISCAN_CACHE = Path(config.setdefault("iscan_cache", str(RESULTS / ".iscan_cache.db")))
+ISCAN_JOBS = int(config.setdefault("iscan_jobs", 1))
+ISCAN_RETRIES = int(config.setdefault("iscan_retries", 2))
+
+BROWSER_SHARDS = int(config.setdefault("browser_shards", 1))
+BROWSER_PARTITION = str(config.setdefault("browser_partition", "genome"))
+BY_TAXON = BROWSER_SHARDS > 1 and BROWSER_PARTITION != "genome"
+# Kept between runs, updated in place by browser_build.py --incremental
+BROWSER_INCREMENTAL = bool(config.setdefault("browser_incremental", False))
+BROWSER_STATE = RESULTS / ".browser_build.db"
+# Typed Parquet copies of hmmer.tsv, neighbors.tsv and iscan.tsv
+COLUMNAR = bool(config.setdefault("columnar", False))
+TABLE_EXT = "parquet" if COLUMNAR else "tsv"
+
+# Snakemake benchmark: files, and the JSON lines of the Python stages
+# (workflow/scripts/perf.py), merged per run by utils/perf_report.py
+BENCHMARKS = RESULTS / "benchmarks"
+os.environ.setdefault("PANDOOMAIN_PERF", str((BENCHMARKS / "stages.jsonl").resolve()))
+os.environ.setdefault("PANDOOMAIN_RUN", datetime.now().strftime("%Y%m%dT%H%M%S"))
 
 ONLY_REFSEQ = bool(config.setdefault("only_refseq", False))
 OFFLINE_MODE = bool(config.setdefault("offline", False))
@@ -47,5 +77,9 @@ assert IN_QUERIES.is_dir(), (
     + f"\nI failed to find it at: {IN_QUERIES.resolve()}"
 )
 
+assert not (BROWSER_INCREMENTAL and BROWSER_SHARDS > 1), bold_red(
+    "browser_incremental does not work with browser_shards above 1."
+)
+
 if not OFFLINE_MODE:
     assert is_internet_on(), bold_red("No network connection.")
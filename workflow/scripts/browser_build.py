@@ -0,0 +1,1376 @@
+#!/usr/bin/env python3
+"""
+Build the SQLite database for the browser visualizer.
+
+Loads iscan.tsv, genomes_metadata.tsv and neighbors.tsv into a single
+pandoomain.db with a normalized schema:
+
+    genomes   genome_id -> genome, org, strain
+    contigs   contig_id -> contig
+    products  product_id -> product
+    queries   query_id -> queries
+    pfams     pfam_id -> pfam, pfam_desc
+    proteins  pid_id -> pid
+    genes     one row per neighbor gene, keyed on (genome_id, nei, gene_order)
+    domains   one row per domain hit, keyed on (pid_id, n)
+    tiles     one row per neighborhood, keyed on (genome_id, nei)
+    search    full-text index of the neighborhoods, rowid is tile_id
+
+Strings repeated on every row are stored once in a lookup table and
+referenced by integer id; strand is stored as 1/-1.
+genes and domains are WITHOUT ROWID tables, so the rows of a
+neighborhood, or the domains of a protein, sit together on disk.
+The neighbors, iscan and metadata views give back the flat layout.
+
+A tile holds everything the browser draws for a neighborhood
+(organism, genes and their domains) as zlib-compressed JSON,
+so showing a neighborhood is a single primary-key lookup.
+
+search is a contentless FTS5 table with the trigram tokenizer, one
+document per neighborhood with the genome, organism, pids, locus tags,
+gene names, products and Pfam hits of its genes. Any substring of three
+or more characters is an index lookup, so prefixes and partial ids or
+descriptions are found without scanning the genes. Only the index is
+stored, the text is already in the other tables.
+
+The database is a build artifact, written from scratch every time,
+so it is loaded without a journal or fsyncs, with one executemany per
+chunk inside a single transaction per table. Indexes are created after
+the rows are in, then ANALYZE and VACUUM leave it compact and with
+statistics for the query planner.
+
+With --shards N the genomes are split into N shard databases, each a
+complete database of the layout above, built in parallel by a process
+pool. Genomes go to a shard by a hash of their accession, or, with
+--partition RANK and --ranks genomes_ranks.tsv, whole taxa of that rank
+go to the least loaded shard. output_db is then a small manifest:
+
+    shards    shard_id -> file, genomes, neighborhoods, bytes
+    genomes   genome -> shard_id
+    proteins  (pid, shard_id) for every shard with the pid
+
+so a reader opens only the shards of the genomes and pids it looks for.
+Shards are written next to the manifest as pandoomain.shard<i>.db.
+
+With --incremental STATE_DB, a database kept at STATE_DB between runs
+is updated in place and hard linked (across file systems, copied) to
+output_db. It also holds a hash of the rows of each genome and of the
+domains of each pid; only the genomes whose rows changed, and the
+neighborhoods with a protein whose domains changed, are deleted and
+loaded again, in one transaction. Values no longer used stay in the
+lookup tables until the next full build.
+
+iscan and neighbors can also be the typed Parquet copies written by
+columnar.py (pyarrow needed). Only the columns listed below are read,
+and the genome and pid filters of shards and updates skip whole row
+groups instead of parsing every row; shards then read their genomes
+straight from the Parquet file instead of a partitioned TSV.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from perf import Stage, timed
+
+CHUNK_SIZE = 200_000  # rows
+CACHE_SIZE = -(1 << 20)  # KiB, negative means size instead of pages
+# One page per HTTP range request when the browser reads the file lazily;
+# a tile fits in one page, scans stay cheap
+PAGE_SIZE = 4096  # bytes
+TILES_BATCH = 10_000  # neighborhoods per executemany
+TILES_LEVEL = 6  # zlib compression level
+# bm25 weights of the search columns, ids count more than descriptions
+SEARCH_WEIGHTS = {
+    "genome": 10.0,
+    "org": 2.0,
+    "pid": 10.0,
+    "locus_tag": 10.0,
+    "gene": 5.0,
+    "product": 1.0,
+    "pfam": 1.0,
+}
+
+PRAGMAS = {
+    "page_size": PAGE_SIZE,  # first, before any table exists
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "cache_size": CACHE_SIZE,
+    "temp_store": "MEMORY",
+    "locking_mode": "EXCLUSIVE",
+}
+
+STRANDS = {"+": 1, "-": -1}
+
+# Columns read from each table, in the order of the tuples of read_chunks
+ISCAN_COLUMNS = ["pid", "start", "end", "length", "memberDB", "memberDB_txt"]
+ISCAN_INTEGERS = ["start", "end", "length"]
+METADATA_COLUMNS = ["genome", "org", "strain"]
+NEIGHBORS_COLUMNS = [
+    "genome",
+    "neid",
+    "neoff",
+    "order",
+    "pid",
+    "gene",
+    "product",
+    "start",
+    "end",
+    "strand",
+    "frame",
+    "locus_tag",
+    "contig",
+    "queries",
+]
+NEIGHBORS_INTEGERS = ["neid", "neoff", "order", "start", "end"]
+
+SCHEMA = """
+    CREATE TABLE genomes (
+        genome_id INTEGER PRIMARY KEY,
+        genome TEXT NOT NULL,
+        org TEXT,
+        strain TEXT
+    );
+
+    CREATE TABLE contigs (
+        contig_id INTEGER PRIMARY KEY,
+        contig TEXT NOT NULL
+    );
+
+    CREATE TABLE products (
+        product_id INTEGER PRIMARY KEY,
+        product TEXT NOT NULL
+    );
+
+    CREATE TABLE queries (
+        query_id INTEGER PRIMARY KEY,
+        queries TEXT NOT NULL
+    );
+
+    CREATE TABLE pfams (
+        pfam_id INTEGER PRIMARY KEY,
+        pfam TEXT NOT NULL,
+        pfam_desc TEXT
+    );
+
+    CREATE TABLE proteins (
+        pid_id INTEGER PRIMARY KEY,
+        pid TEXT NOT NULL
+    );
+
+    CREATE TABLE genes (
+        genome_id INTEGER NOT NULL REFERENCES genomes,
+        nei INTEGER NOT NULL,
+        neioff INTEGER,
+        gene_order INTEGER NOT NULL,
+        pid_id INTEGER REFERENCES proteins,
+        gene TEXT,
+        product_id INTEGER REFERENCES products,
+        start INTEGER,
+        "end" INTEGER,
+        strand INTEGER,
+        frame INTEGER,
+        locus_tag TEXT,
+        contig_id INTEGER REFERENCES contigs,
+        query_id INTEGER REFERENCES queries,
+        PRIMARY KEY (genome_id, nei, gene_order)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE domains (
+        pid_id INTEGER NOT NULL REFERENCES proteins,
+        n INTEGER NOT NULL,
+        start INTEGER,
+        stop INTEGER,
+        length INTEGER,
+        pfam_id INTEGER REFERENCES pfams,
+        PRIMARY KEY (pid_id, n)
+    ) WITHOUT ROWID;
+
+    -- A rowid table: WITHOUT ROWID is wasteful with rows this large.
+    -- tile_id is explicit so VACUUM keeps it, it is the rowid of search
+    CREATE TABLE tiles (
+        tile_id INTEGER PRIMARY KEY,
+        genome_id INTEGER NOT NULL REFERENCES genomes,
+        nei INTEGER NOT NULL,
+        tile BLOB NOT NULL,
+        UNIQUE (genome_id, nei)
+    );
+
+    CREATE VIRTUAL TABLE search USING fts5(
+        {columns},
+        content = '',
+        tokenize = 'trigram'
+    );
+""".format(columns=", ".join(SEARCH_WEIGHTS))
+
+# Persistent default ranking of search, ORDER BY rank uses it
+SEARCH_RANK = "bm25({})".format(", ".join(map(str, SEARCH_WEIGHTS.values())))
+
+# Genes in tile order, the order of the primary key
+TILES_GENES = """
+    SELECT
+        n.genome_id, n.nei, g.genome, g.org, g.strain,
+        n.gene_order, n.neioff, n.pid_id, p.pid, n.gene, r.product,
+        n.start, n."end", CASE n.strand WHEN 1 THEN '+' WHEN -1 THEN '-' END,
+        n.locus_tag, c.contig, q.queries
+    FROM genes n
+    JOIN genomes g USING (genome_id)
+    LEFT JOIN proteins p USING (pid_id)
+    LEFT JOIN products r USING (product_id)
+    LEFT JOIN contigs c USING (contig_id)
+    LEFT JOIN queries q USING (query_id)
+    {where}
+    ORDER BY n.genome_id, n.nei, n.gene_order
+"""
+
+TILES_DOMAINS = """
+    SELECT d.start, d.stop, d.length, f.pfam, f.pfam_desc
+    FROM domains d
+    LEFT JOIN pfams f USING (pfam_id)
+    WHERE d.pid_id = ?
+    ORDER BY d.n
+"""
+
+# The flat tables the browser used to query
+VIEWS = """
+    CREATE VIEW metadata AS
+    SELECT genome, org, strain FROM genomes;
+
+    CREATE VIEW iscan AS
+    SELECT p.pid, d.start, d.stop, d.length, f.pfam, f.pfam_desc
+    FROM domains d
+    JOIN proteins p USING (pid_id)
+    LEFT JOIN pfams f USING (pfam_id);
+
+    CREATE VIEW neighbors AS
+    SELECT
+        g.genome, n.nei, n.neioff, n.gene_order, p.pid, n.gene, r.product,
+        n.start, n."end",
+        CASE n.strand WHEN 1 THEN '+' WHEN -1 THEN '-' END AS strand,
+        n.frame, n.locus_tag, c.contig, q.queries
+    FROM genes n
+    JOIN genomes g USING (genome_id)
+    LEFT JOIN proteins p USING (pid_id)
+    LEFT JOIN products r USING (product_id)
+    LEFT JOIN contigs c USING (contig_id)
+    LEFT JOIN queries q USING (query_id);
+"""
+
+# Content hashes of the rows of each genome and of the domains of each
+# pid, see update()
+HASHES_SCHEMA = """
+    CREATE TABLE genome_hashes (
+        genome_id INTEGER PRIMARY KEY REFERENCES genomes,
+        hash INTEGER NOT NULL
+    );
+
+    CREATE TABLE protein_hashes (
+        pid_id INTEGER PRIMARY KEY REFERENCES proteins,
+        hash INTEGER NOT NULL
+    );
+"""
+
+STORED_GENOME_HASHES = """
+    SELECT g.genome, h.hash
+    FROM genome_hashes h JOIN genomes g USING (genome_id)
+"""
+
+STORED_PID_HASHES = """
+    SELECT p.pid, h.hash
+    FROM protein_hashes h JOIN proteins p USING (pid_id)
+"""
+
+# The genomes, pids and neighborhoods an update replaces
+STALE_SCHEMA = """
+    CREATE TEMP TABLE stale_genomes (genome_id INTEGER PRIMARY KEY);
+    CREATE TEMP TABLE stale_pids (pid_id INTEGER PRIMARY KEY);
+    CREATE TEMP TABLE stale_tiles (genome_id INTEGER PRIMARY KEY);
+"""
+
+# Neighborhoods drawn with the old rows
+STALE_TILES = """
+    INSERT INTO temp.stale_tiles
+    SELECT genome_id FROM temp.stale_genomes
+    UNION
+    SELECT genome_id FROM genes WHERE pid_id IN temp.stale_pids
+"""
+
+MANIFEST_SCHEMA = """
+    CREATE TABLE shards (
+        shard_id INTEGER PRIMARY KEY,
+        file TEXT NOT NULL,
+        genomes INTEGER NOT NULL,
+        neighborhoods INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    );
+
+    CREATE TABLE genomes (
+        genome TEXT PRIMARY KEY,
+        shard_id INTEGER NOT NULL REFERENCES shards
+    ) WITHOUT ROWID;
+
+    CREATE TABLE proteins (
+        pid TEXT NOT NULL,
+        shard_id INTEGER NOT NULL REFERENCES shards,
+        PRIMARY KEY (pid, shard_id)
+    ) WITHOUT ROWID;
+"""
+
+INDEXES = [
+    "CREATE UNIQUE INDEX idx_genomes_genome ON genomes (genome)",
+    "CREATE UNIQUE INDEX idx_contigs_contig ON contigs (contig)",
+    "CREATE UNIQUE INDEX idx_products_product ON products (product)",
+    "CREATE UNIQUE INDEX idx_queries_queries ON queries (queries)",
+    "CREATE UNIQUE INDEX idx_pfams_pfam ON pfams (pfam)",
+    "CREATE UNIQUE INDEX idx_proteins_pid ON proteins (pid)",
+    "CREATE INDEX idx_genes_pid ON genes (pid_id)",
+]
+
+
+class Lookup:
+    """
+    Dictionary encoder for a lookup table.
+
+    Args:
+        table: Table name, its first column is the integer id.
+    """
+
+    def __init__(self, table: str):
+        self.table = table
+        self.ids: Dict[str, int] = {}
+        self.last_id = 0
+        self.pending: List[Tuple] = []
+
+    def __call__(self, value: Optional[str], *extra) -> Optional[int]:
+        if value is None:
+            return None
+        if (id_ := self.ids.get(value)) is None:
+            self.last_id += 1
+            id_ = self.ids[value] = self.last_id
+            self.pending.append((id_, value, *extra))
+        return id_
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        # Continue the ids of a table already written
+        for row in conn.execute(f"SELECT * FROM {self.table}"):
+            self.ids[row[1]] = row[0]
+        self.last_id = max(self.ids.values(), default=0)
+
+    def flush(self, conn: sqlite3.Connection) -> None:
+        if self.pending:
+            marks = ", ".join("?" * len(self.pending[0]))
+            conn.executemany(f"INSERT INTO {self.table} VALUES ({marks})", self.pending)
+            self.pending = []
+
+
+class Encoder:
+    """
+    Encodes the rows of the TSVs for the genes and domains tables,
+    replacing the repeated strings by the ids of their lookup tables.
+    """
+
+    def __init__(self):
+        self.genomes = Lookup("genomes")
+        self.contigs = Lookup("contigs")
+        self.products = Lookup("products")
+        self.queries = Lookup("queries")
+        self.pfams = Lookup("pfams")
+        self.proteins = Lookup("proteins")
+        self.domains_per_pid: Dict[int, int] = defaultdict(int)
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        for lookup in (
+            self.genomes,
+            self.contigs,
+            self.products,
+            self.queries,
+            self.pfams,
+            self.proteins,
+        ):
+            lookup.load(conn)
+
+    def metadata(self, row: Tuple) -> int:
+        genome, org, strain = row
+        return self.genomes(genome, org, strain)
+
+    def iscan(self, row: Tuple) -> Tuple:
+        pid, start, stop, length, pfam, pfam_desc = row
+        pid_id = self.proteins(pid)
+        self.domains_per_pid[pid_id] += 1
+        return (
+            pid_id,
+            self.domains_per_pid[pid_id],
+            start,
+            stop,
+            length,
+            self.pfams(pfam, pfam_desc),
+        )
+
+    def neighbors(self, row: Tuple) -> Tuple:
+        (
+            genome,
+            nei,
+            neioff,
+            order,
+            pid,
+            gene,
+            product,
+            gstart,
+            gend,
+            strand,
+            frame,
+            locus_tag,
+            contig,
+            query,
+        ) = row
+        return (
+            self.genomes(genome, None, None),
+            nei,
+            neioff,
+            order,
+            self.proteins(pid),
+            gene,
+            self.products(product),
+            gstart,
+            gend,
+            STRANDS.get(strand),
+            frame,
+            locus_tag,
+            self.contigs(contig),
+            self.queries(query),
+        )
+
+
+def connect(output_db: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(output_db, isolation_level=None)
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+def read_frames(
+    input_path: str, columns: List[str], integers: List[str], keep
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield the wanted columns of a TSV, or of its Parquet copy
+    (columnar.py), in chunks of rows.
+
+    From Parquet only those columns are read, and the row groups the
+    keep filter excludes are skipped on their statistics.
+    """
+    if input_path.endswith(".parquet"):
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(input_path, format="parquet")
+        header = dataset.schema.names
+    else:
+        header = pd.read_csv(input_path, sep="\t", nrows=0).columns
+
+    present = [col for col in columns if col in header]
+    if not present:
+        print(f"ERROR: None of {columns} found in {input_path}", file=sys.stderr)
+        sys.exit(1)
+    if keep is not None and keep[0] not in present:
+        present.append(keep[0])
+
+    if input_path.endswith(".parquet"):
+        condition = None
+        if keep is not None:
+            condition = ds.field(keep[0]).isin(list(keep[1]))
+        for batch in dataset.to_batches(
+            columns=present, filter=condition, batch_size=CHUNK_SIZE
+        ):
+            yield batch.to_pandas(integer_object_nulls=True)
+        return
+
+    reader = pd.read_csv(
+        input_path,
+        sep="\t",
+        usecols=present,
+        dtype={col: "str" for col in present if col not in integers},
+        chunksize=CHUNK_SIZE,
+        low_memory=False,
+    )
+    for chunk in reader:
+        if keep is not None:
+            chunk = chunk[chunk[keep[0]].isin(keep[1])]
+        yield chunk
+
+
+def read_chunks(
+    input_path: str,
+    columns: List[str],
+    integers: List[str],
+    keep: Optional[Tuple[str, Set[str]]] = None,
+) -> Iterator[List[Tuple]]:
+    """
+    Yield the rows of the wanted columns as lists of tuples.
+
+    Columns missing from the input are loaded as NULL.
+    Integer columns that fail to parse are set to 0.
+
+    Args:
+        input_path: TSV, or Parquet when it ends in .parquet.
+        columns: Columns, in the order of the tuples.
+        integers: Integer columns.
+        keep: (column, values), only the rows with one of the values.
+    """
+    for chunk in read_frames(input_path, columns, integers, keep):
+        for col in integers:
+            if col in chunk:
+                chunk[col] = (
+                    pd.to_numeric(chunk[col], errors="coerce").fillna(0).astype(int)
+                )
+        chunk = chunk.reindex(columns=columns)
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield list(chunk.itertuples(index=False, name=None))
+
+
+def load_rows(conn: sqlite3.Connection, table: str, chunks, encode, lookups) -> int:
+    """
+    Encode and insert the rows of a TSV in one transaction,
+    or in the transaction already open.
+
+    Returns:
+        Number of rows loaded.
+    """
+    print(f"Loading '{table}'...")
+    start = perf_counter()
+
+    insert = None
+    n_rows = 0
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    for rows in chunks:
+        encoded = [encode(row) for row in rows]
+        for lookup in lookups:
+            lookup.flush(conn)
+        if encoded:
+            if insert is None:
+                marks = ", ".join("?" * len(encoded[0]))
+                insert = f"INSERT OR REPLACE INTO {table} VALUES ({marks})"
+            conn.executemany(insert, encoded)
+        n_rows += len(rows)
+        print(f"  {n_rows} rows", end="\r")
+    if own_transaction:
+        conn.execute("COMMIT")
+
+    elapsed = perf_counter() - start
+    rate = n_rows / elapsed if elapsed > 0 else 0
+    print(f"  {n_rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+    return n_rows
+
+
+def iter_tiles(
+    conn: sqlite3.Connection, where: str = ""
+) -> Iterator[Tuple[int, int, dict]]:
+    """
+    Yield (genome_id, nei, tile) for every neighborhood,
+    or those of the genes matching a WHERE clause.
+
+    Genes follow their order on the contig, which is by start.
+    """
+    domains = conn.cursor()
+    key, tile = None, None
+
+    for row in conn.execute(TILES_GENES.format(where=where)):
+        genome_id, nei, genome, org, strain = row[:5]
+        order, neioff, pid_id, pid, name, product, start, end, strand = row[5:14]
+        locus_tag, contig, queries = row[14:]
+
+        if (genome_id, nei) != key:
+            if tile is not None:
+                yield (*key, tile)
+            key = (genome_id, nei)
+            tile = {"genome": genome, "nei": nei, "org": org, "strain": strain}
+            tile["genes"] = []
+
+        tile["genes"].append(
+            {
+                "gene_order": order,
+                "neioff": neioff,
+                "pid": pid,
+                "gene": name,
+                "product": product,
+                "start": start,
+                "end": end,
+                "strand": strand,
+                "locus_tag": locus_tag,
+                "contig": contig,
+                "queries": queries,
+                "domains": [
+                    {
+                        "start": dstart,
+                        "stop": dstop,
+                        "length": dlength,
+                        "pfam": pfam,
+                        "pfam_desc": pfam_desc,
+                    }
+                    for dstart, dstop, dlength, pfam, pfam_desc in domains.execute(
+                        TILES_DOMAINS, (pid_id,)
+                    )
+                ],
+            }
+        )
+
+    if tile is not None:
+        yield (*key, tile)
+
+
+def search_document(tile: dict) -> Tuple[str, ...]:
+    """
+    The text of a neighborhood, one value per search column.
+
+    Repeated values are indexed once, they would only inflate bm25.
+    """
+
+    def join(values) -> str:
+        return "\n".join(dict.fromkeys(v for v in values if v))
+
+    genes = tile["genes"]
+    domains = [d for gene in genes for d in gene["domains"]]
+    return (
+        tile["genome"],
+        join([tile["org"], tile["strain"]]),
+        join(gene["pid"] for gene in genes),
+        join(gene["locus_tag"] for gene in genes),
+        join(gene["gene"] for gene in genes),
+        join(gene["product"] for gene in genes),
+        join(value for d in domains for value in (d["pfam"], d["pfam_desc"])),
+    )
+
+
+def build_tiles(conn: sqlite3.Connection, where: str = "") -> int:
+    """
+    Precompute the compressed tile and the search document of every
+    neighborhood, or of those of the genes matching a WHERE clause,
+    in one transaction or in the transaction already open.
+
+    Returns:
+        Number of tiles written.
+    """
+    print("Building neighborhood tiles and search index...")
+    start = perf_counter()
+
+    columns = ", ".join(SEARCH_WEIGHTS)
+    marks = ", ".join("?" * (len(SEARCH_WEIGHTS) + 1))
+    insert_search = f"INSERT INTO search (rowid, {columns}) VALUES ({marks})"
+
+    def flush(tiles, documents):
+        conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", tiles)
+        conn.executemany(insert_search, documents)
+
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN")
+    [(last_id,)] = conn.execute("SELECT COALESCE(MAX(tile_id), 0) FROM tiles")
+
+    n_tiles, n_bytes, tiles, documents = 0, 0, [], []
+    # Read through one cursor while inserting through another, both in
+    # the same transaction; the query does not touch the tiles table
+    for genome_id, nei, tile in iter_tiles(conn, where):
+        tile_id = last_id + n_tiles + len(tiles) + 1
+        blob = zlib.compress(
+            json.dumps(tile, separators=(",", ":")).encode(), TILES_LEVEL
+        )
+        tiles.append((tile_id, genome_id, nei, blob))
+        documents.append((tile_id, *search_document(tile)))
+        n_bytes += len(blob)
+        if len(tiles) >= TILES_BATCH:
+            flush(tiles, documents)
+            n_tiles += len(tiles)
+            tiles, documents = [], []
+            print(f"  {n_tiles} tiles", end="\r")
+    flush(tiles, documents)
+    n_tiles += len(tiles)
+    if own_transaction:
+        conn.execute("INSERT INTO search (search) VALUES ('optimize')")
+        conn.execute("COMMIT")
+
+    elapsed = perf_counter() - start
+    mean = n_bytes / n_tiles if n_tiles else 0
+    print(f"  {n_tiles} tiles in {elapsed:.1f}s, {mean:.0f} bytes per tile")
+    return n_tiles
+
+
+def delete_tiles(conn: sqlite3.Connection, where: str) -> int:
+    """
+    Delete the tiles matching a WHERE clause and their search documents.
+
+    The search table keeps no text, the documents to remove from the
+    index are made again from the tiles.
+
+    Returns:
+        Number of tiles deleted.
+    """
+    columns = ", ".join(SEARCH_WEIGHTS)
+    marks = ", ".join("?" * (len(SEARCH_WEIGHTS) + 1))
+    delete_search = (
+        f"INSERT INTO search (search, rowid, {columns}) VALUES ('delete', {marks})"
+    )
+
+    n_tiles = 0
+    for tile_id, blob in conn.execute(f"SELECT tile_id, tile FROM tiles {where}"):
+        tile = json.loads(zlib.decompress(blob))
+        conn.execute(delete_search, (tile_id, *search_document(tile)))
+        n_tiles += 1
+    conn.execute(f"DELETE FROM tiles {where}")
+    return n_tiles
+
+
+def row_hash(row: Tuple) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(repr(row).encode(), digest_size=8).digest(), "little"
+    )
+
+
+def hash_inputs(
+    iscan_tsv: str, metadata_tsv: str, neighbors_tsv: str
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Hash the rows of each genome (metadata and neighbors) and the domains
+    of each pid, as parsed for loading.
+
+    The hash of a key is the sum of the hashes of its rows, so it does not
+    depend on the order of the rows. Sums are signed 64-bit, like SQLite
+    integers.
+
+    Returns:
+        genome -> hash, pid -> hash
+    """
+    genome_sums: Dict[str, int] = defaultdict(int)
+    pid_sums: Dict[str, int] = defaultdict(int)
+
+    inputs = [
+        (metadata_tsv, METADATA_COLUMNS, [], genome_sums),
+        (neighbors_tsv, NEIGHBORS_COLUMNS, NEIGHBORS_INTEGERS, genome_sums),
+        (iscan_tsv, ISCAN_COLUMNS, ISCAN_INTEGERS, pid_sums),
+    ]
+    for input_tsv, columns, integers, sums in inputs:
+        for rows in read_chunks(input_tsv, columns, integers):
+            for row in rows:
+                if row[0] is not None:
+                    sums[row[0]] += row_hash(row)
+
+    def signed(value: int) -> int:
+        return (value + (1 << 63)) % (1 << 64) - (1 << 63)
+
+    return (
+        {genome: signed(value) for genome, value in genome_sums.items()},
+        {pid: signed(value) for pid, value in pid_sums.items()},
+    )
+
+
+def write_hashes(
+    conn: sqlite3.Connection,
+    encoder: Encoder,
+    genome_hashes: Dict[str, int],
+    pid_hashes: Dict[str, int],
+) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO genome_hashes VALUES (?, ?)",
+        [(encoder.genomes.ids[genome], h) for genome, h in genome_hashes.items()],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO protein_hashes VALUES (?, ?)",
+        [(encoder.proteins.ids[pid], h) for pid, h in pid_hashes.items()],
+    )
+
+
+def build(
+    iscan_tsv: str,
+    metadata_tsv: str,
+    neighbors_tsv: str,
+    output_db: str,
+    pids: Optional[Set[str]] = None,
+    track: bool = False,
+    genomes: Optional[Set[str]] = None,
+) -> int:
+    """
+    Write the browser database from the pipeline results.
+
+    Args:
+        iscan_tsv: iscan.tsv
+        metadata_tsv: genomes_metadata.tsv
+        neighbors_tsv: neighbors.tsv
+        output_db: Path to the output SQLite database, replaced if present.
+        pids: Only load the domains of these proteins, all when None.
+        track: Keep the content hashes update() needs.
+        genomes: Only load these genomes, all when None.
+
+    Returns:
+        Number of rows loaded.
+    """
+    for path in (iscan_tsv, metadata_tsv, neighbors_tsv):
+        if not os.path.exists(path):
+            print(f"ERROR: Input file not found at '{path}'", file=sys.stderr)
+            sys.exit(1)
+
+    output_dir = os.path.dirname(output_db)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Built aside and renamed, so a failed build never looks complete
+    tmp_db = f"{output_db}.tmp"
+    if os.path.exists(tmp_db):
+        os.remove(tmp_db)
+
+    start = perf_counter()
+    conn = connect(tmp_db)
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT INTO search (search, rank) VALUES ('rank', ?)", (SEARCH_RANK,))
+
+    encoder = Encoder()
+    n_rows = 0
+
+    # Genomes with metadata come first, the rest are added from neighbors
+    print("Loading 'genomes'...")
+    conn.execute("BEGIN")
+    by_genome = None if genomes is None else ("genome", genomes)
+    for rows in read_chunks(metadata_tsv, METADATA_COLUMNS, [], by_genome):
+        for row in rows:
+            encoder.metadata(row)
+        encoder.genomes.flush(conn)
+        n_rows += len(rows)
+    conn.execute("COMMIT")
+
+    by_pid = None if pids is None else ("pid", pids)
+    n_rows += load_rows(
+        conn,
+        "domains",
+        read_chunks(iscan_tsv, ISCAN_COLUMNS, ISCAN_INTEGERS, by_pid),
+        encoder.iscan,
+        [encoder.proteins, encoder.pfams],
+    )
+
+    n_rows += load_rows(
+        conn,
+        "genes",
+        read_chunks(neighbors_tsv, NEIGHBORS_COLUMNS, NEIGHBORS_INTEGERS, by_genome),
+        encoder.neighbors,
+        [
+            encoder.genomes,
+            encoder.proteins,
+            encoder.products,
+            encoder.contigs,
+            encoder.queries,
+        ],
+    )
+
+    print("Creating indexes and views...")
+    index_start = perf_counter()
+    conn.execute("BEGIN")
+    for index in INDEXES:
+        conn.execute(index)
+    conn.execute("COMMIT")
+    conn.executescript(VIEWS)
+    print(f"  ...done in {perf_counter() - index_start:.1f}s")
+
+    build_tiles(conn)
+
+    if track:
+        print("Hashing genomes and proteins...")
+        conn.executescript(HASHES_SCHEMA)
+        conn.execute("BEGIN")
+        hashes = hash_inputs(iscan_tsv, metadata_tsv, neighbors_tsv)
+        write_hashes(conn, encoder, *hashes)
+        conn.execute("COMMIT")
+
+    print("Analyzing and vacuuming...")
+    conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_db, output_db)
+
+    elapsed = perf_counter() - start
+    print(
+        f"Wrote {n_rows} rows to {output_db} in {elapsed:.1f}s "
+        f"({n_rows / elapsed:,.0f} rows/sec overall)"
+    )
+    return n_rows
+
+
+def changed(stored: Dict[str, int], current: Dict[str, int]) -> Set[str]:
+    # New, different and removed keys
+    return {
+        key
+        for key in stored.keys() | current.keys()
+        if stored.get(key) != current.get(key)
+    }
+
+
+def update(iscan_tsv: str, metadata_tsv: str, neighbors_tsv: str, db: str) -> int:
+    """
+    Bring a database built with track=True up to date with the TSVs.
+
+    Genomes whose rows changed, and proteins whose domains changed, are
+    deleted and loaded again; then the tiles of those genomes, and of the
+    neighborhoods with those proteins, are built again. All in a single
+    transaction on the database in place, with its indexes.
+
+    Returns:
+        Number of rows loaded, 0 when nothing changed.
+    """
+    start = perf_counter()
+    print("Hashing genomes and proteins...")
+    genome_hashes, pid_hashes = hash_inputs(iscan_tsv, metadata_tsv, neighbors_tsv)
+
+    conn = sqlite3.connect(db, isolation_level=None)
+    conn.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+    stored_genomes = dict(conn.execute(STORED_GENOME_HASHES))
+    stored_pids = dict(conn.execute(STORED_PID_HASHES))
+    genomes = changed(stored_genomes, genome_hashes)
+    pids = changed(stored_pids, pid_hashes)
+    print(f"  {len(genomes)} genomes and {len(pids)} proteins changed")
+    if not genomes and not pids:
+        conn.close()
+        return 0
+
+    encoder = Encoder()
+    encoder.load(conn)
+
+    conn.executescript(STALE_SCHEMA)
+    conn.execute("BEGIN")
+    for table, lookup, keys in (
+        ("stale_genomes", encoder.genomes, genomes),
+        ("stale_pids", encoder.proteins, pids),
+    ):
+        conn.executemany(
+            f"INSERT INTO temp.{table} VALUES (?)",
+            [(lookup.ids[key],) for key in keys if key in lookup.ids],
+        )
+
+    conn.execute(STALE_TILES)
+    n_deleted = delete_tiles(conn, "WHERE genome_id IN temp.stale_tiles")
+    conn.execute("DELETE FROM genes WHERE genome_id IN temp.stale_genomes")
+    conn.execute("DELETE FROM domains WHERE pid_id IN temp.stale_pids")
+    conn.execute("DELETE FROM genome_hashes WHERE genome_id IN temp.stale_genomes")
+    conn.execute("DELETE FROM protein_hashes WHERE pid_id IN temp.stale_pids")
+
+    removed = [genome for genome in genomes if genome not in genome_hashes]
+    conn.executemany(
+        "DELETE FROM genomes WHERE genome_id = ?",
+        [(encoder.genomes.ids.pop(genome),) for genome in removed],
+    )
+
+    print("Loading 'genomes'...")
+    for rows in read_chunks(metadata_tsv, METADATA_COLUMNS, [], ("genome", genomes)):
+        for row in rows:
+            genome, org, strain = row
+            if genome in encoder.genomes.ids:
+                conn.execute(
+                    "UPDATE genomes SET org = ?, strain = ? WHERE genome_id = ?",
+                    (org, strain, encoder.genomes.ids[genome]),
+                )
+            else:
+                encoder.metadata(row)
+        encoder.genomes.flush(conn)
+
+    n_rows = load_rows(
+        conn,
+        "domains",
+        read_chunks(iscan_tsv, ISCAN_COLUMNS, ISCAN_INTEGERS, ("pid", pids)),
+        encoder.iscan,
+        [encoder.proteins, encoder.pfams],
+    )
+    n_rows += load_rows(
+        conn,
+        "genes",
+        read_chunks(
+            neighbors_tsv, NEIGHBORS_COLUMNS, NEIGHBORS_INTEGERS, ("genome", genomes)
+        ),
+        encoder.neighbors,
+        [
+            encoder.genomes,
+            encoder.proteins,
+            encoder.products,
+            encoder.contigs,
+            encoder.queries,
+        ],
+    )
+
+    # Neighborhoods to draw with the new rows, of new genomes too
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp.stale_tiles VALUES (?)",
+        [(encoder.genomes.ids[genome],) for genome in genomes if genome not in removed],
+    )
+    build_tiles(conn, "WHERE n.genome_id IN temp.stale_tiles")
+
+    write_hashes(
+        conn,
+        encoder,
+        {key: genome_hashes[key] for key in genomes if key in genome_hashes},
+        {key: pid_hashes[key] for key in pids if key in pid_hashes},
+    )
+    conn.execute("COMMIT")
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+    print(
+        f"Updated {db} in {perf_counter() - start:.1f}s: {n_rows} rows loaded, "
+        f"{n_deleted} neighborhoods drawn again"
+    )
+    return n_rows
+
+
+def build_incremental(
+    iscan_tsv: str,
+    metadata_tsv: str,
+    neighbors_tsv: str,
+    output_db: str,
+    state_db: str,
+) -> int:
+    """
+    Update state_db, or build it when it has no content hashes,
+    and link output_db to it.
+
+    output_db is a hard link to state_db, so a run costs only the rows it
+    updates; where a link cannot be made (output_db on another file system)
+    state_db is copied, a cost linear in the size of the database.
+
+    Returns:
+        Number of rows loaded.
+    """
+    tracked = False
+    if os.path.exists(state_db):
+        conn = sqlite3.connect(state_db)
+        tables = conn.execute("SELECT name FROM sqlite_schema").fetchall()
+        conn.close()
+        tracked = ("genome_hashes",) in tables
+
+    if tracked:
+        n_rows = update(iscan_tsv, metadata_tsv, neighbors_tsv, state_db)
+    else:
+        n_rows = build(iscan_tsv, metadata_tsv, neighbors_tsv, state_db, track=True)
+
+    # Still linked from the last run, rename() would do nothing
+    if os.path.exists(output_db) and os.path.samefile(state_db, output_db):
+        return n_rows
+
+    os.makedirs(os.path.dirname(output_db) or ".", exist_ok=True)
+    tmp_db = f"{output_db}.tmp"
+    if os.path.lexists(tmp_db):
+        os.remove(tmp_db)
+    try:
+        os.link(state_db, tmp_db)
+    except OSError:
+        shutil.copyfile(state_db, tmp_db)
+    os.replace(tmp_db, output_db)
+    return n_rows
+
+
+def shard_file(output_db: str, shard_id: int) -> str:
+    root, ext = os.path.splitext(output_db)
+    return f"{root}.shard{shard_id}{ext}"
+
+
+def hash_shard(genome: str, n_shards: int) -> int:
+    # crc32 is stable across runs and machines, unlike hash()
+    return zlib.crc32(genome.encode()) % n_shards
+
+
+def taxon_shards(ranks_tsv: str, rank: str, n_shards: int) -> Dict[str, int]:
+    """
+    Assign whole taxa to shards, the largest taxa first, each to the
+    shard with the fewest genomes.
+
+    Returns:
+        genome -> shard_id, genomes without the rank are left out.
+    """
+    ranks = pd.read_csv(ranks_tsv, sep="\t", usecols=["genome", rank], dtype="str")
+    ranks = ranks.dropna()
+    sizes = Counter(ranks[rank])
+
+    load = [0] * n_shards
+    taxon_shard = {}
+    for taxon, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        shard_id = load.index(min(load))
+        taxon_shard[taxon] = shard_id
+        load[shard_id] += size
+
+    return {
+        genome: taxon_shard[taxon]
+        for genome, taxon in zip(ranks["genome"], ranks[rank])
+    }
+
+
+def partition(
+    input_tsv: str, out_paths: List[str], genome_shards: Dict[str, int]
+) -> None:
+    """
+    Split a TSV with a genome column into one TSV per shard.
+
+    Values are copied as text, build() parses them as for a single database.
+    """
+    n_shards = len(out_paths)
+    for path in out_paths:
+        with open(path, "w") as h:
+            h.write("\t".join(pd.read_csv(input_tsv, sep="\t", nrows=0).columns))
+            h.write("\n")
+
+    reader = pd.read_csv(
+        input_tsv,
+        sep="\t",
+        dtype="str",
+        keep_default_na=False,
+        chunksize=CHUNK_SIZE,
+    )
+    for chunk in reader:
+        shard_ids = [
+            genome_shards.get(genome, hash_shard(genome, n_shards))
+            for genome in chunk["genome"]
+        ]
+        for shard_id, rows in chunk.groupby(shard_ids):
+            rows.to_csv(
+                out_paths[shard_id], sep="\t", index=False, header=False, mode="a"
+            )
+
+
+def build_shard(
+    iscan_tsv: str,
+    metadata_tsv: str,
+    neighbors_tsv: str,
+    output_db: str,
+    genomes: Optional[Set[str]] = None,
+) -> int:
+    # Only the domains of the proteins in the shard's neighborhoods
+    by_genome = None if genomes is None else ("genome", genomes)
+    pids = {
+        pid
+        for rows in read_chunks(neighbors_tsv, ["pid"], [], by_genome)
+        for (pid,) in rows
+        if pid is not None
+    }
+    return build(
+        iscan_tsv, metadata_tsv, neighbors_tsv, output_db, pids, genomes=genomes
+    )
+
+
+def split_genomes(
+    input_paths: List[str], n_shards: int, genome_shards: Dict[str, int]
+) -> List[Set[str]]:
+    """
+    Assign the genomes of the inputs to shards, as partition() does,
+    for Parquet inputs that each shard reads with a genome filter instead.
+    """
+    shards: List[Set[str]] = [set() for _ in range(n_shards)]
+    for input_path in input_paths:
+        for rows in read_chunks(input_path, ["genome"], []):
+            for (genome,) in rows:
+                if genome is not None:
+                    shard_id = genome_shards.get(genome, hash_shard(genome, n_shards))
+                    shards[shard_id].add(genome)
+    return shards
+
+
+def build_manifest(output_db: str, shard_dbs: List[str]) -> None:
+    """
+    Index the genomes and pids of the shards in the manifest database.
+    """
+    print("Writing the shard manifest...")
+    tmp_db = f"{output_db}.tmp"
+    if os.path.exists(tmp_db):
+        os.remove(tmp_db)
+
+    conn = connect(tmp_db)
+    conn.executescript(MANIFEST_SCHEMA)
+    for shard_id, shard_db in enumerate(shard_dbs):
+        conn.execute("ATTACH ? AS shard", (shard_db,))
+        conn.execute("BEGIN")
+        conn.execute(
+            """
+            INSERT INTO shards
+            SELECT
+                ?, ?,
+                (SELECT COUNT(*) FROM shard.genomes),
+                (SELECT COUNT(*) FROM shard.tiles),
+                ?
+            """,
+            (shard_id, os.path.basename(shard_db), os.path.getsize(shard_db)),
+        )
+        for table, column in (("genomes", "genome"), ("proteins", "pid")):
+            conn.execute(
+                f"INSERT INTO {table} SELECT {column}, ? FROM shard.{table}",
+                (shard_id,),
+            )
+        conn.execute("COMMIT")
+        conn.execute("DETACH shard")
+    conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp_db, output_db)
+
+
+def build_sharded(
+    iscan_tsv: str,
+    metadata_tsv: str,
+    neighbors_tsv: str,
+    output_db: str,
+    n_shards: int,
+    jobs: int,
+    ranks_tsv: Optional[str] = None,
+    rank: Optional[str] = None,
+) -> List[Tuple[str, float, int]]:
+    """
+    Write n_shards shard databases in parallel and their manifest.
+
+    Returns:
+        (shard database, seconds, rows loaded) of each shard.
+    """
+    start = perf_counter()
+    genome_shards = taxon_shards(ranks_tsv, rank, n_shards) if rank else {}
+
+    output_dir = os.path.dirname(output_db) or "."
+    os.makedirs(output_dir, exist_ok=True)
+    shard_dbs = [shard_file(output_db, i) for i in range(n_shards)]
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        print(f"Partitioning into {n_shards} shards...")
+        if neighbors_tsv.endswith(".parquet"):
+            # Each shard reads its genomes straight from the Parquet file
+            shard_genomes = split_genomes(
+                [neighbors_tsv, metadata_tsv], n_shards, genome_shards
+            )
+            shard_inputs = [
+                (metadata_tsv, neighbors_tsv, shard_genomes[i]) for i in range(n_shards)
+            ]
+        else:
+            shard_tsvs = {}
+            inputs = {"neighbors": neighbors_tsv, "metadata": metadata_tsv}
+            for name, input_tsv in inputs.items():
+                paths = [
+                    os.path.join(tmp_dir, f"{name}.{i}.tsv") for i in range(n_shards)
+                ]
+                partition(input_tsv, paths, genome_shards)
+                shard_tsvs[name] = paths
+            shard_inputs = [
+                (shard_tsvs["metadata"][i], shard_tsvs["neighbors"][i], None)
+                for i in range(n_shards)
+            ]
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [
+                pool.submit(
+                    timed(build_shard),
+                    iscan_tsv,
+                    shard_metadata,
+                    shard_neighbors,
+                    shard_dbs[i],
+                    genomes,
+                )
+                for i, (shard_metadata, shard_neighbors, genomes) in enumerate(
+                    shard_inputs
+                )
+            ]
+            shards = []
+            for shard_db, future in zip(shard_dbs, futures):
+                n_rows, seconds = future.result()
+                shards.append((shard_db, seconds, n_rows))
+
+    build_manifest(output_db, shard_dbs)
+    remove_stale_shards(output_db, shard_dbs)
+    print(f"Wrote {n_shards} shards in {perf_counter() - start:.1f}s")
+    return shards
+
+
+def remove_stale_shards(output_db: str, keep: List[str]) -> None:
+    # Left by a previous build with more shards, or before a single database
+    for path in glob.glob(shard_file(glob.escape(output_db), "*")):
+        if path not in keep:
+            os.remove(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Build the SQLite DB for the browser visualizer."
+    )
+    parser.add_argument("iscan_tsv", help="iscan.tsv, or iscan.parquet")
+    parser.add_argument("metadata_tsv", help="genomes_metadata.tsv")
+    parser.add_argument("neighbors_tsv", help="neighbors.tsv, or neighbors.parquet")
+    parser.add_argument("output_db", help="Path to output SQLite database")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split into this many shard databases, output_db is their manifest",
+    )
+    parser.add_argument(
+        "--partition",
+        default="genome",
+        help="'genome' to shard by a hash of the genome, or a rank of --ranks",
+    )
+    parser.add_argument("--ranks", help="genomes_ranks.tsv, to shard by taxon")
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="Shards built at once"
+    )
+    parser.add_argument(
+        "--incremental",
+        metavar="STATE_DB",
+        help="Update STATE_DB in place, only the changed genomes, and copy it",
+    )
+
+    args = parser.parse_args()
+
+    if args.shards < 1 or args.jobs < 1:
+        parser.error("--shards and --jobs must be at least 1")
+    if args.partition != "genome" and args.ranks is None:
+        parser.error(f"--partition {args.partition} needs --ranks")
+    if args.incremental and args.shards > 1:
+        parser.error("--incremental updates a single database, not shards")
+
+    with Stage("browser_build") as stage:
+        if args.incremental:
+            stage.add(
+                build_incremental(
+                    args.iscan_tsv,
+                    args.metadata_tsv,
+                    args.neighbors_tsv,
+                    args.output_db,
+                    args.incremental,
+                )
+            )
+            remove_stale_shards(args.output_db, [])
+        elif args.shards == 1:
+            stage.add(
+                build(
+                    args.iscan_tsv,
+                    args.metadata_tsv,
+                    args.neighbors_tsv,
+                    args.output_db,
+                )
+            )
+            remove_stale_shards(args.output_db, [])
+        else:
+            shards = build_sharded(
+                args.iscan_tsv,
+                args.metadata_tsv,
+                args.neighbors_tsv,
+                args.output_db,
+                args.shards,
+                args.jobs,
+                args.ranks,
+                None if args.partition == "genome" else args.partition,
+            )
+            for shard_db, seconds, n_rows in shards:
+                stage.item(os.path.basename(shard_db), seconds, n_rows)
+
+
+if __name__ == "__main__":
+    main()
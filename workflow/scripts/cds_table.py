@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Per-genome CDS tables, parsed once from the GFF after the download.
+
+build: write genomes/cds/{genome}.cds for every genome of genomes.tsv,
+       with one row per CDS (pseudogenes excluded) and the columns
+       neighbors.R needs, sorted by contig and order, the rank of the
+       CDS on its contig by start position.
+       Genomes whose table is up to date (same .gff size and mtime, or
+       same sha256 in a packed store) are skipped.
+
+cat:   write a table as TSV to stdout:
+
+    cds_table.py cat results/genomes/cds/GCF_001286845.1.cds
+
+A .cds file is little-endian and memory-mappable:
+
+    MAGIC          8 bytes
+    toc size       uint64
+    toc            JSON: genome, stamp, rows, and the dtype, offset
+                   (from the first array) and count of every array
+    arrays         one per numeric column, and an offsets (int64,
+                   rows + 1) and a data (UTF-8) array per string
+                   column, each aligned to 8 bytes
+
+so CdsTable reads a column as a numpy view of the file, without parsing,
+and neighbors.R reads the arrays with readBin.
+Missing strings are empty, missing strand and frame are 0 and -1.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from genome_store import GenomeStore
+from perf import Stage, timed
+
+MAGIC = b"PDMCDS01"
+ALIGN = 8
+
+NUMBERS = {
+    "order": "<i4",
+    "start": "<i8",
+    "end": "<i8",
+    "strand": "<i1",
+    "frame": "<i1",
+}
+STRINGS = ["pid", "gene", "contig", "locus_tag", "product"]
+
+# GFF attribute of each string column, contig is the seqid column
+ATTRIBUTES = {
+    "pid": "protein_id",
+    "gene": "gene",
+    "locus_tag": "locus_tag",
+    "product": "product",
+}
+
+# Columns of cat, as read_gff in neighbors.R returns them
+TSV_COLUMNS = [
+    "genome",
+    "pid",
+    "gene",
+    "order",
+    "start",
+    "end",
+    "contig",
+    "strand",
+    "frame",
+    "locus_tag",
+    "product",
+]
+
+STRANDS = {"+": 1, "-": -1}
+STRAND_CHARS = {1: "+", -1: "-", 0: ""}
+
+# Set per worker, see init_worker
+STORE = None
+
+
+def init_worker(store: Optional[str]) -> None:
+    global STORE
+    if store is not None:
+        STORE = GenomeStore(store)
+
+
+def gff_path(genomes_dir: Path, genome: str) -> Path:
+    return genomes_dir / genome / f"{genome}.gff"
+
+
+def cds_path(cds_dir: Path, genome: str) -> Path:
+    return cds_dir / f"{genome}.cds"
+
+
+def parse_gff(gff: bytes) -> Dict[str, list]:
+    """
+    Columns of the CDS features of a GFF3, sorted by contig and order.
+    """
+    rows = []
+    for line in gff.decode().splitlines():
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) != 9 or fields[2] != "CDS":
+            continue
+
+        attributes = dict(
+            item.split("=", 1) for item in fields[8].split(";") if "=" in item
+        )
+        if "pseudo" in attributes:
+            continue
+
+        rows.append(
+            (
+                fields[0],
+                int(fields[3]),
+                int(fields[4]),
+                STRANDS.get(fields[6], 0),
+                int(fields[7]) if fields[7].isdigit() else -1,
+                attributes,
+            )
+        )
+
+    # Definition of neighbor: same contig, ordered by start position
+    rows.sort(key=lambda row: row[1])
+    order: Dict[str, int] = {}
+    ranked = []
+    for row in rows:
+        order[row[0]] = order.get(row[0], 0) + 1
+        ranked.append((row[0], order[row[0]], row))
+    ranked.sort(key=lambda item: (item[0], item[1]))
+
+    columns: Dict[str, list] = {col: [] for col in [*NUMBERS, *STRINGS]}
+    for contig, i, (_, start, end, strand, frame, attributes) in ranked:
+        columns["order"].append(i)
+        columns["start"].append(start)
+        columns["end"].append(end)
+        columns["strand"].append(strand)
+        columns["frame"].append(frame)
+        columns["contig"].append(contig)
+        for col, attribute in ATTRIBUTES.items():
+            columns[col].append(attributes.get(attribute, ""))
+    return columns
+
+
+def write_table(path: Path, genome: str, stamp: str, columns: Dict[str, list]) -> int:
+    """
+    Write the columns of parse_gff as a .cds file, atomically.
+
+    Returns:
+        Number of rows.
+    """
+    n_rows = len(columns["order"])
+
+    arrays = {}
+    for col, dtype in NUMBERS.items():
+        arrays[col] = np.asarray(columns[col], dtype=dtype)
+    for col in STRINGS:
+        encoded = [value.encode() for value in columns[col]]
+        offsets = np.zeros(n_rows + 1, dtype="<i8")
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        arrays[f"{col}.offsets"] = offsets
+        arrays[f"{col}.data"] = np.frombuffer(b"".join(encoded), dtype="u1")
+
+    def aligned(n: int) -> int:
+        return -(-n // ALIGN) * ALIGN
+
+    toc = {"genome": genome, "stamp": stamp, "rows": n_rows, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        toc["arrays"][name] = [array.dtype.str, offset, len(array)]
+        offset = aligned(offset + array.nbytes)
+    toc_bytes = json.dumps(toc).encode()
+    base = aligned(len(MAGIC) + 8 + len(toc_bytes))
+
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as h:
+        h.write(MAGIC)
+        h.write(struct.pack("<Q", len(toc_bytes)))
+        h.write(toc_bytes)
+        for name, array in arrays.items():
+            h.seek(base + toc["arrays"][name][1])
+            h.write(array.tobytes())
+        h.truncate(base + offset)
+    os.replace(tmp_path, path)
+
+    return n_rows
+
+
+class CdsTable:
+    """
+    Read-only, memory-mapped view of a .cds file.
+
+    Numeric columns are numpy arrays backed by the file,
+    string columns are decoded on access.
+
+    Args:
+        path: .cds file written by build.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as h:
+            self.mm = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[: len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError(f"Not a CDS table: {self.path}")
+        (toc_size,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        toc = json.loads(self.mm[start : start + toc_size])
+        base = -(-(start + toc_size) // ALIGN) * ALIGN
+
+        self.genome = toc["genome"]
+        self.stamp = toc["stamp"]
+        self.rows = toc["rows"]
+        self.arrays = {
+            name: np.frombuffer(self.mm, dtype=dtype, count=count, offset=base + offset)
+            for name, (dtype, offset, count) in toc["arrays"].items()
+        }
+
+    def close(self) -> None:
+        self.arrays = {}
+        try:
+            self.mm.close()
+        except BufferError:
+            pass  # Columns still in use, unmapped when they are freed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, col: str):
+        if col in NUMBERS:
+            return self.arrays[col]
+        if col in STRINGS:
+            offsets = self.arrays[f"{col}.offsets"]
+            data = self.arrays[f"{col}.data"].tobytes()
+            return [
+                data[offsets[i] : offsets[i + 1]].decode() for i in range(self.rows)
+            ]
+        raise KeyError(col)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The table in the layout of cat, missing values as NA.
+        """
+        df = pd.DataFrame({col: self[col] for col in [*NUMBERS, *STRINGS]})
+        df["strand"] = df["strand"].map(STRAND_CHARS)
+        df["frame"] = df["frame"].where(df["frame"] >= 0).astype("Int8")
+        df = df.replace("", pd.NA)
+        df.insert(0, "genome", self.genome)
+        return df[TSV_COLUMNS]
+
+
+def read_stamp(path: Path) -> Optional[str]:
+    try:
+        with CdsTable(path) as table:
+            return table.stamp
+    except (OSError, ValueError):
+        return None
+
+
+def stamp(genomes_dir: Path, genome: str) -> str:
+    if STORE is not None:
+        return STORE.sha256(genome, "gff")
+    stat = gff_path(genomes_dir, genome).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def build_genome(task: Tuple[str, str, str, str]) -> Tuple[str, int]:
+    genome, gff, out, current = task
+
+    if STORE is not None:
+        columns = parse_gff(STORE.get(genome, "gff"))
+    else:
+        columns = parse_gff(Path(gff).read_bytes())
+
+    return genome, write_table(Path(out), genome, current, columns)
+
+
+def build(
+    genomes_tsv: str, cds_dir: str, cpus: int, store: Optional[str] = None
+) -> List[Tuple[str, float, int]]:
+    """
+    Write the CDS table of every genome listed in genomes.tsv.
+
+    Args:
+        genomes_tsv: genomes.tsv written by hydrate.py.
+        cds_dir: Directory of the .cds files, updated in place.
+        cpus: Number of parsing processes.
+        store: Packed genome store to read instead of loose files.
+
+    Returns:
+        (genome, seconds, CDS) of each genome parsed.
+    """
+    genomes_dir = Path(genomes_tsv).parent
+    cds_dir = Path(cds_dir)
+    cds_dir.mkdir(parents=True, exist_ok=True)
+    genomes = list(pd.read_table(genomes_tsv, usecols=["genome"]).genome)
+
+    init_worker(store)
+
+    tasks = []
+    for genome in genomes:
+        current = stamp(genomes_dir, genome)
+        out = cds_path(cds_dir, genome)
+        if read_stamp(out) != current:
+            gff = str(gff_path(genomes_dir, genome))
+            tasks.append((genome, gff, str(out), current))
+
+    print(f"Parsing {len(tasks)} of {len(genomes)} GFFs...")
+
+    n_rows = 0
+    timings = []
+    with Pool(cpus, initializer=init_worker, initargs=(store,)) as pool:
+        results = pool.imap_unordered(timed(build_genome), tasks)
+        for i, ((genome, rows), seconds) in enumerate(results):
+            n_rows += rows
+            timings.append((genome, seconds, rows))
+            print(f"  {i + 1}/{len(tasks)} genomes", end="\r")
+
+    print(f"\nWrote {n_rows} CDS.")
+    return timings
+
+
+def cat(paths: List[str], out=None) -> None:
+    out = sys.stdout if out is None else out
+    for i, path in enumerate(paths):
+        with CdsTable(path) as table:
+            df = table.to_frame()
+        df.to_csv(out, sep="\t", index=False, header=i == 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Parse-once CDS tables of the downloaded genomes."
+    )
+    parser.add_argument("--store", help="Packed genome store (see genome_store.py)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Write the CDS table of every genome")
+    p_build.add_argument("genomes_tsv", help="genomes.tsv written by hydrate.py")
+    p_build.add_argument("cds_dir", help="Directory of the .cds files")
+    p_build.add_argument("--cpus", type=int, default=os.cpu_count())
+
+    p_cat = sub.add_parser("cat", help="Write CDS tables as TSV to stdout")
+    p_cat.add_argument("cds", nargs="+", help=".cds files")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with Stage("cds_tables") as stage:
+            for genome, seconds, n_rows in build(
+                args.genomes_tsv, args.cds_dir, args.cpus, args.store
+            ):
+                stage.item(genome, seconds, n_rows)
+    elif args.command == "cat":
+        cat(args.cds)
+
+
+if __name__ == "__main__":
+    main()
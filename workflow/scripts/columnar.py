@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Typed columnar copies of the pipeline tables.
+
+    columnar.py neighbors neighbors.tsv neighbors.parquet
+
+Writes a Parquet file of hmmer.tsv, neighbors.tsv or iscan.tsv with a
+type per column, so no later stage parses numbers from text again.
+Rows are sorted by genome (by pid for iscan) and cut in row groups of
+ROW_GROUP_SIZE rows with min/max statistics: a reader asks only for the
+columns it needs, and skips the row groups a filter on the sort key
+excludes (see read_chunks in browser_build.py).
+String columns with few distinct values are dictionary-encoded.
+
+Columns not listed for a table keep the type Arrow infers,
+like the query columns of neighbors.tsv.
+"""
+
+import argparse
+import os
+import sys
+from time import perf_counter
+from typing import Dict, List, NamedTuple
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from perf import Stage
+
+ROW_GROUP_SIZE = 1 << 20  # rows
+COMPRESSION = "zstd"
+NULL_VALUES = ["", "NA"]
+
+INT = pa.int64()
+FLOAT = pa.float64()
+STRING = pa.string()
+
+
+class Layout(NamedTuple):
+    types: Dict[str, pa.DataType]
+    sort: List[str]
+    dictionary: List[str]
+
+
+LAYOUTS = {
+    "hmmer": Layout(
+        types={
+            "genome": STRING,
+            "pid": STRING,
+            "query": STRING,
+            "score": FLOAT,
+            "evalue": FLOAT,
+            "start": INT,
+            "end": INT,
+            "pid_txt": STRING,
+            "query_txt": STRING,
+        },
+        sort=["genome", "pid"],
+        dictionary=["genome", "query", "query_txt"],
+    ),
+    "neighbors": Layout(
+        types={
+            "genome": STRING,
+            "nei": INT,
+            "neid": INT,
+            "neioff": INT,
+            "neoff": INT,
+            "order": INT,
+            "pid": STRING,
+            "gene": STRING,
+            "product": STRING,
+            "start": INT,
+            "end": INT,
+            "strand": STRING,
+            "frame": INT,
+            "locus_tag": STRING,
+            "contig": STRING,
+            "queries": STRING,
+        },
+        sort=["genome", "nei", "neid", "order"],
+        dictionary=["genome", "gene", "product", "strand", "contig", "queries"],
+    ),
+    "iscan": Layout(
+        types={
+            "pid": STRING,
+            "start": INT,
+            "end": INT,
+            "length": INT,
+            "analysis": STRING,
+            "interpro": STRING,
+            "interpro_txt": STRING,
+            "memberDB": STRING,
+            "memberDB_txt": STRING,
+        },
+        sort=["pid", "start", "end"],
+        dictionary=["analysis", "interpro", "interpro_txt", "memberDB", "memberDB_txt"],
+    ),
+}
+
+
+def read_tsv(input_tsv: str, layout: Layout) -> pa.Table:
+    with open(input_tsv) as h:
+        header = h.readline().rstrip("\n").split("\t")
+
+    return pacsv.read_csv(
+        input_tsv,
+        parse_options=pacsv.ParseOptions(delimiter="\t"),
+        convert_options=pacsv.ConvertOptions(
+            column_types={
+                col: layout.types[col] for col in header if col in layout.types
+            },
+            null_values=NULL_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def convert(kind: str, input_tsv: str, output_parquet: str) -> int:
+    """
+    Write the typed, sorted Parquet copy of a TSV.
+
+    The whole table is sorted in memory, as Arrow columns.
+
+    Returns:
+        Number of rows written.
+    """
+    layout = LAYOUTS[kind]
+    start = perf_counter()
+
+    table = read_tsv(input_tsv, layout)
+    keys = [col for col in layout.sort if col in table.column_names]
+    if keys:
+        table = table.sort_by([(col, "ascending") for col in keys])
+
+    # After sorting, dictionary arrays do not sort everywhere
+    for col in layout.dictionary:
+        if col in table.column_names:
+            i = table.column_names.index(col)
+            table = table.set_column(i, col, table[col].dictionary_encode())
+
+    tmp_parquet = f"{output_parquet}.tmp"
+    pq.write_table(
+        table,
+        tmp_parquet,
+        row_group_size=ROW_GROUP_SIZE,
+        compression=COMPRESSION,
+        write_statistics=True,
+    )
+    os.replace(tmp_parquet, output_parquet)
+
+    elapsed = perf_counter() - start
+    print(
+        f"Wrote {table.num_rows} rows to {output_parquet} in {elapsed:.1f}s "
+        f"({os.path.getsize(input_tsv) / 2**20:.1f} MiB TSV -> "
+        f"{os.path.getsize(output_parquet) / 2**20:.1f} MiB Parquet)",
+        file=sys.stderr,
+    )
+    return table.num_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Typed columnar (Parquet) copy of a pipeline table."
+    )
+    parser.add_argument("kind", choices=LAYOUTS, help="Table of the TSV")
+    parser.add_argument("input_tsv")
+    parser.add_argument("output_parquet")
+    args = parser.parse_args()
+
+    with Stage(f"columnar_{args.kind}") as stage:
+        stage.add(convert(args.kind, args.input_tsv, args.output_parquet))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Packed store for the downloaded genomes.
+
+Instead of a {genome}/{genome}.faa and .gff pair per assembly,
+every file is compressed as an independent gzip member and appended
+to a shard (shards/{n}.gz). An SQLite index maps (genome, kind) to
+the shard, offset and size of its member, so any genome is read
+with one seek. A shard is itself a valid .gz file.
+
+A .faa is written as several members of about BLOCK_SIZE, split
+between records, and the index also maps (genome, pid) to its member
+and its place in it, so one protein is read by decompressing one block.
+
+Used by hydrate.py (writes), hmmer.py (reads) and, through the command
+line, by the R scripts:
+
+    genome_store.py cat STORE GENOME {faa,gff}
+    genome_store.py protein STORE GENOME PID
+    genome_store.py ls STORE
+"""
+
+import argparse
+import gzip
+import hashlib
+import sqlite3
+import sys
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+from urllib.parse import quote
+
+SHARD_SIZE = 2**32  # bytes, a new shard is started past this size
+BLOCK_SIZE = 2**16  # uncompressed bytes per member of a .faa
+BLOCK_CACHE = 16  # decompressed blocks kept, neighboring pids share them
+COMPRESS_LEVEL = 6
+KINDS = ("faa", "gff")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        genome TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        shard INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        csize INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        PRIMARY KEY (genome, kind)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS proteins (
+        genome TEXT NOT NULL,
+        pid TEXT NOT NULL,
+        block INTEGER NOT NULL,
+        bsize INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (genome, pid)
+    ) WITHOUT ROWID;
+"""
+
+
+def records(faa: bytes) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yield (pid, start, end) for every record of a .faa.
+    """
+    start = faa.find(b">")
+    while start != -1:
+        end = faa.find(b"\n>", start)
+        end = len(faa) if end == -1 else end + 1
+        header_end = faa.find(b"\n", start, end)
+        header = faa[start + 1 : end if header_end == -1 else header_end]
+        yield header.split(None, 1)[0].decode(), start, end
+        start = end if end < len(faa) else -1
+
+
+def compress_faa(faa: bytes) -> Tuple[bytes, list]:
+    """
+    Compress a .faa as gzip members of about BLOCK_SIZE, split between records.
+
+    Returns:
+        The members, concatenated, and a (pid, block, bsize, start, length)
+        row per record: the offset and size of its member in them,
+        and its offset and size in the uncompressed member.
+    """
+    members, rows, pending = [], [], []
+    block = chunk = 0
+
+    def flush(end: int):
+        nonlocal block, chunk
+        member = gzip.compress(faa[chunk:end], compresslevel=COMPRESS_LEVEL)
+        for pid, start, stop in pending:
+            rows.append((pid, block, len(member), start - chunk, stop - start))
+        members.append(member)
+        block += len(member)
+        chunk = end
+        pending.clear()
+
+    for pid, start, end in records(faa):
+        pending.append((pid, start, end))
+        if end - chunk >= BLOCK_SIZE:
+            flush(end)
+    if chunk < len(faa) or not members:
+        flush(len(faa))
+
+    return b"".join(members), rows
+
+
+class GenomeStore:
+    """
+    Read and append genome files in a packed store.
+
+    Args:
+        root: Store directory.
+        writable: Open for appending; only one writer process at a time,
+            but put may be called from several threads.
+    """
+
+    def __init__(self, root, writable: bool = False):
+        self.root = Path(root)
+        self.shards = self.root / "shards"
+        self.writable = writable
+        self.lock = threading.Lock()
+
+        if writable:
+            self.shards.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(self.root / "index.db", check_same_thread=False)
+            self.conn.executescript(SCHEMA)
+        else:
+            uri = f"file:{quote(str(self.root / 'index.db'))}?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True)
+
+        # Stores written before the protein index lack its table
+        query = "SELECT 1 FROM sqlite_master WHERE name = 'proteins'"
+        self.protein_index = self.conn.execute(query).fetchone() is not None
+
+        self.block = lru_cache(maxsize=BLOCK_CACHE)(self.read_block)
+        self.scanned = lru_cache(maxsize=1)(self.scan)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def shard_path(self, shard: int) -> Path:
+        return self.shards / f"{shard:05d}.gz"
+
+    def locate(self, genome: str, kind: str) -> Optional[Tuple]:
+        return self.conn.execute(
+            "SELECT shard, offset, csize, size, sha256 FROM files "
+            "WHERE genome = ? AND kind = ?",
+            (genome, kind),
+        ).fetchone()
+
+    def __contains__(self, genome: str) -> bool:
+        return all(self.locate(genome, kind) is not None for kind in KINDS)
+
+    def genomes(self) -> list:
+        rows = self.conn.execute("SELECT DISTINCT genome FROM files ORDER BY genome")
+        return [genome for (genome,) in rows]
+
+    def size(self, genome: str, kind: str = "faa") -> int:
+        return self.locate(genome, kind)[3]
+
+    def sha256(self, genome: str, kind: str = "faa") -> str:
+        return self.locate(genome, kind)[4]
+
+    def get(self, genome: str, kind: str = "faa") -> bytes:
+        """
+        Uncompressed contents of a genome file.
+
+        Raises:
+            KeyError: The genome file is not in the store.
+        """
+        if (location := self.locate(genome, kind)) is None:
+            raise KeyError(f"{genome} {kind}")
+        shard, offset, csize, _, _ = location
+
+        with open(self.shard_path(shard), "rb") as h:
+            h.seek(offset)
+            return gzip.decompress(h.read(csize))
+
+    def proteins(self, genome: str) -> Iterator[Tuple[str, bytes]]:
+        """
+        Yield (pid, record) for every protein of a genome.
+        """
+        faa = self.get(genome, "faa")
+        for pid, start, end in records(faa):
+            yield pid, faa[start:end]
+
+    def protein(self, genome: str, pid: str) -> Optional[bytes]:
+        """
+        One protein record, decompressing only the block that holds it.
+
+        Genomes stored before the protein index are scanned instead.
+        """
+        if self.protein_index:
+            location = self.conn.execute(
+                "SELECT shard, files.offset + block, bsize, start, length "
+                "FROM proteins JOIN files USING (genome) "
+                "WHERE genome = ? AND pid = ? AND kind = 'faa'",
+                (genome, pid),
+            ).fetchone()
+            if location is not None:
+                shard, offset, bsize, start, length = location
+                return self.block(shard, offset, bsize)[start : start + length]
+
+            indexed = self.conn.execute(
+                "SELECT 1 FROM proteins WHERE genome = ? LIMIT 1", (genome,)
+            ).fetchone()
+            if indexed is not None:
+                return None
+
+        if self.locate(genome, "faa") is not None:
+            return self.scanned(genome).get(pid)
+        return None
+
+    def read_block(self, shard: int, offset: int, bsize: int) -> bytes:
+        with open(self.shard_path(shard), "rb") as h:
+            h.seek(offset)
+            return gzip.decompress(h.read(bsize))
+
+    def scan(self, genome: str) -> dict:
+        # The last record of a repeated pid, as in the protein index
+        return dict(self.proteins(genome))
+
+    def put(self, genome: str, kind: str, path) -> None:
+        """
+        Compress a file into the current shard and index it.
+        """
+        assert self.writable, "Store opened read-only."
+        data = Path(path).read_bytes()
+        if kind == "faa":
+            member, proteins = compress_faa(data)
+        else:
+            member, proteins = gzip.compress(data, compresslevel=COMPRESS_LEVEL), []
+
+        with self.lock:
+            query = "SELECT MAX(shard) FROM files"
+            shard = self.conn.execute(query).fetchone()[0] or 0
+            shard_path = self.shard_path(shard)
+            if shard_path.exists() and shard_path.stat().st_size >= SHARD_SIZE:
+                shard += 1
+                shard_path = self.shard_path(shard)
+
+            with open(shard_path, "ab") as h:
+                offset = h.tell()
+                h.write(member)
+
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        genome,
+                        kind,
+                        shard,
+                        offset,
+                        len(member),
+                        len(data),
+                        hashlib.sha256(data).hexdigest(),
+                    ),
+                )
+                if kind == "faa":
+                    self.conn.execute(
+                        "DELETE FROM proteins WHERE genome = ?", (genome,)
+                    )
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO proteins VALUES (?, ?, ?, ?, ?, ?)",
+                        [(genome, *row) for row in proteins],
+                    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Read the packed genome store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cat = sub.add_parser("cat", help="Write a genome file to stdout")
+    cat.add_argument("store", help="Store directory")
+    cat.add_argument("genome", help="Genome assembly accession")
+    cat.add_argument("kind", choices=KINDS)
+
+    protein = sub.add_parser("protein", help="Write a protein record to stdout")
+    protein.add_argument("store", help="Store directory")
+    protein.add_argument("genome", help="Genome assembly accession")
+    protein.add_argument("pid", help="Protein ID")
+
+    ls = sub.add_parser("ls", help="List the stored genomes")
+    ls.add_argument("store", help="Store directory")
+
+    args = parser.parse_args()
+
+    with GenomeStore(args.store) as store:
+        if args.command == "cat":
+            try:
+                sys.stdout.buffer.write(store.get(args.genome, args.kind))
+            except KeyError:
+                print(f"ERROR: {args.genome} {args.kind} not in store", file=sys.stderr)
+                sys.exit(1)
+        elif args.command == "protein":
+            if (record := store.protein(args.genome, args.pid)) is None:
+                print(f"ERROR: {args.pid} not in {args.genome}", file=sys.stderr)
+                sys.exit(1)
+            sys.stdout.buffer.write(record)
+        elif args.command == "ls":
+            for genome in store.genomes():
+                print(genome)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
+import io
 import os
 import re
 import sys
@@ -6,14 +9,18 @@ from collections import namedtuple
 from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
+from queue import Queue
+from threading import Thread
 from typing import Iterable, Union
 
-import numpy as np
 import pandas as pd
 import pyhmmer
 from pyhmmer import hmmsearch
-from pyhmmer.easel import SequenceFile
-from pyhmmer.plan7 import HMM, HMMFile
+from pyhmmer.easel import DigitalSequenceBlock, SequenceFile
+from pyhmmer.plan7 import HMM, Background, HMMFile, Profile
+
+from genome_store import GenomeStore
+from perf import Stage, timed
 
 DEPENDENCY_HELL = "0.10.14"
 assert (
@@ -21,10 +28,6 @@ assert (
 ), f"Use pyhmmer version: {DEPENDENCY_HELL}, newer versions break pandoomain."
 
 
-QUERIES_DIR = Path(sys.argv[1])
-GENOMES_FILE = sys.argv[2]
-OUT_FILE = Path(sys.argv[3])
-
 GENOME_REGEX = re.compile(r"(GC[FA]_\d+\.\d)\.faa$")
 FIELDS = (
     "genome",
@@ -39,6 +42,25 @@ FIELDS = (
 )
 Results = namedtuple("Results", FIELDS)
 
+# Profiles are configured for this length,
+# the pipeline reconfigures them for each target
+PROFILE_L = 400
+
+# Optimized profiles, pyhmmer threads and genome store, set per worker by init_worker
+PROFILES = None
+CPUS = 1
+STORE = None
+
+EXECUTORS = ("process", "thread")
+
+# Streaming mode
+QUEUE_SIZE = 64  # genomes waiting to be written
+BUFFER_SIZE = 1 << 20  # bytes
+ENCODING = "utf-8"
+
+# Per-genome cache
+HASH_CHUNK = 1 << 20  # bytes
+
 
 class HMMFiles(Iterable[HMM]):
     def __init__(self, *files: Union[str, bytes, os.PathLike]):
@@ -56,6 +78,182 @@ def get_hmms(queries_path):
     return hmms_files
 
 
+def read_genome(genome_path):
+    if STORE is not None:
+        faa = io.BytesIO(STORE.get(parse_genome(genome_path), "faa"))
+        genome_file = SequenceFile(faa, digital=True, format="fasta")
+    else:
+        genome_file = SequenceFile(genome_path, digital=True)
+
+    with genome_file:
+        return genome_file.read_block()
+
+
+def faa_hash(genome_path):
+    if STORE is not None:
+        return STORE.sha256(parse_genome(genome_path), "faa")
+    return hash_file(genome_path).hexdigest()
+
+
+def batch_genomes(genomes_paths, budget, getsize=os.path.getsize):
+    # .faa size is a cheap proxy for the residues
+    batches = []
+    batch, size = [], 0
+    for genome_path in genomes_paths:
+        batch.append(genome_path)
+        size += getsize(genome_path)
+        if size >= budget:
+            batches.append(batch)
+            batch, size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run_batch(genomes_paths, cache=None):
+    """
+    Search several small proteomes as a single target block.
+
+    Sequences are renamed to their position in the block, and an index
+    maps each position back to its genome and protein id.
+
+    E-values are rescaled with a per-genome Z (its number of sequences),
+    so they match a genome by genome search.
+    Inclusion uses the trusted cutoffs, so it does not depend on Z.
+    """
+    out = {}
+    shards = {}
+    index = []  # block position -> (genome_id, pid, Z)
+    sequences = []
+
+    for genome_path in genomes_paths:
+        genome_id = parse_genome(genome_path)
+
+        if cache is not None:
+            shards[genome_id] = shard = cache.shard(genome_id, faa_hash(genome_path))
+            if (hittup := cache.load(shard)) is not None:
+                out[genome_id] = hittup
+                continue
+
+        genome = read_genome(genome_path)
+        out[genome_id] = []
+        for seq in genome:
+            index.append((genome_id, seq.name, len(genome)))
+            seq.name = str(len(index) - 1).encode()
+            sequences.append(seq)
+
+    if not sequences:
+        return out
+
+    block = DigitalSequenceBlock(sequences[0].alphabet, sequences)
+    results = hmmsearch(PROFILES, block, cpus=CPUS, bit_cutoffs="trusted")
+
+    for top_hits in results:
+        for hit in top_hits:
+            if hit.included:
+                genome_id, pid, Z = index[int(hit.name)]
+                parsed = parse_hit(hit, genome_id)._replace(
+                    pid=pid.decode("utf-8"), evalue=str(hit.pvalue * Z)
+                )
+                out[genome_id].append(parsed)
+
+    if cache is not None:
+        for genome_id in {genome_id for genome_id, _, _ in index}:
+            cache.save(shards[genome_id], out[genome_id])
+
+    return out
+
+
+def tsv_line(itsv):
+    return "\t".join(itsv) + "\n"
+
+
+def optimize(hmms):
+    profiles = []
+    background = None
+    for hmm in hmms:
+        if background is None:
+            background = Background(hmm.alphabet)
+        profile = Profile(hmm.M, hmm.alphabet)
+        profile.configure(hmm, background, PROFILE_L)
+        profiles.append(profile.to_optimized())
+    return profiles
+
+
+def init_worker(hmms, cpus=1, store=None):
+    # OptimizedProfile can not be pickled,
+    # so the parsed HMMs are sent instead and optimized here
+    global PROFILES, CPUS, STORE
+    PROFILES = optimize(hmms)
+    CPUS = cpus
+    if store is not None:
+        STORE = GenomeStore(store)
+
+
+def search(worker, tasks, hmms, cpus=1, executor="process", store=None):
+    """
+    Yield worker results using at most cpus cores.
+
+    process: a Pool of cpus workers, each hmmsearch on a single thread.
+    thread: tasks run one at a time, and hmmsearch spreads
+            the queries over cpus threads (pyhmmer releases the GIL).
+    """
+    if executor == "thread":
+        init_worker(hmms, cpus, store)
+        yield from map(worker, tasks)
+    else:
+        with Pool(cpus, initializer=init_worker, initargs=(hmms, 1, store)) as pool:
+            yield from pool.imap_unordered(worker, tasks)
+
+
+def hash_file(path, digest=None):
+    digest = hashlib.sha256() if digest is None else digest
+    with open(path, "rb") as h:
+        while chunk := h.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest
+
+
+def hash_hmms(hmms_files):
+    digest = hashlib.sha256()
+    for file in sorted(hmms_files.files):
+        hash_file(file, digest)
+    return digest.hexdigest()
+
+
+class HitsCache:
+    """
+    Content-addressed store of per-genome hit tables.
+
+    A shard lives at {cache_dir}/{queries_hash}/{genome}/{faa_hash}.tsv,
+    so editing the queries or re-downloading a proteome
+    misses the cache, and only that genome is searched again.
+    """
+
+    def __init__(self, cache_dir: Path, queries_hash: str):
+        self.root = Path(cache_dir) / queries_hash
+
+    def shard(self, genome_id, faa_hash) -> Path:
+        return self.root / genome_id / f"{faa_hash}.tsv"
+
+    def load(self, shard: Path):
+        if not shard.is_file():
+            return None
+        with open(shard, encoding=ENCODING) as h:
+            return [Results(*line.rstrip("\n").split("\t")) for line in h]
+
+    def save(self, shard: Path, hittup):
+        shard.parent.mkdir(parents=True, exist_ok=True)
+        for stale in shard.parent.glob("*.tsv"):
+            stale.unlink(missing_ok=True)
+
+        tmp = shard.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "w", encoding=ENCODING) as h:
+            for parsed in hittup:
+                h.write(tsv_line(parsed))
+        tmp.replace(shard)
+
+
 def parse_genome(genome_path):
     genome_path = str(genome_path)
     genome = None
@@ -84,12 +282,16 @@ def parse_hit(hit, genome_id):
     return Results(*out)
 
 
-def run_genome(genome_path, hmms_files):
+def run_genome(genome_path, cache=None):
     genome_id = parse_genome(genome_path)
 
-    with SequenceFile(genome_path, digital=True) as genome_file:
-        genome = genome_file.read_block()
-        results = hmmsearch(hmms_files, genome, bit_cutoffs="trusted")
+    if cache is not None:
+        shard = cache.shard(genome_id, faa_hash(genome_path))
+        if (hittup := cache.load(shard)) is not None:
+            return {genome_id: hittup}
+
+    genome = read_genome(genome_path)
+    results = hmmsearch(PROFILES, genome, cpus=CPUS, bit_cutoffs="trusted")
 
     hittup = []
     for top_hits in results:
@@ -98,35 +300,241 @@ def run_genome(genome_path, hmms_files):
                 parsed = parse_hit(hit, genome_id)
                 hittup.append(parsed)
 
+    if cache is not None:
+        cache.save(shard, hittup)
+
     out = {}
     out[genome_id] = hittup
 
     return out
 
 
-if __name__ == "__main__":
-
-    genomes_paths = pd.read_table(GENOMES_FILE).faa_path
-
-    hmms_files = get_hmms(QUERIES_DIR)
-    worker = partial(run_genome, hmms_files=hmms_files)
-
-    with Pool() as pool:
-        results = pool.imap_unordered(worker, genomes_paths)
-        pool.close()
-        pool.join()
+class StreamWriter(Thread):
+    """
+    Write genome results to a TSV as soon as they are produced.
+
+    Results are handed over through a bounded queue, so a slow disk
+    throttles the producer instead of piling results up in memory.
+
+    Rows go to a hidden partial file next to the output.
+    After each genome is flushed, its id and the partial file size
+    are appended to a checkpoint file.
+    On a restart the partial file is truncated to the last checkpoint,
+    the rows of checkpointed genomes no longer in `genomes` are dropped,
+    and the other checkpointed genomes are skipped.
+    The partial file is renamed to the output once every genome is done.
+    """
+
+    def __init__(self, out_file: Path, genomes: set[str], queue_size: int = QUEUE_SIZE):
+        super().__init__(daemon=True)
+        self.out_file = Path(out_file)
+        self.partial = self.out_file.parent / f".{self.out_file.name}.partial"
+        self.checkpoint = self.out_file.parent / f".{self.out_file.name}.ckpt"
+        self.queue = Queue(maxsize=queue_size)
+        self.error = None
+        self.done = self.resume(genomes)
+
+    def resume(self, genomes: set[str]) -> set[str]:
+        checkpoints = []  # (genome_id, offset), the header has no genome_id
+
+        if self.partial.is_file() and self.checkpoint.is_file():
+            with open(self.checkpoint, encoding=ENCODING) as h:
+                for line in h:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 2:  # torn write
+                        break
+                    checkpoints.append((fields[0], int(fields[1])))
+
+        if not checkpoints:
+            with open(self.partial, "w", encoding=ENCODING) as tsv:
+                tsv.write(tsv_line(FIELDS))
+            offset = self.partial.stat().st_size
+            with open(self.checkpoint, "w", encoding=ENCODING) as h:
+                h.write(tsv_line(("", str(offset))))
+            return set()
+
+        os.truncate(self.partial, checkpoints[-1][1])
+        done = {genome_id for genome_id, _ in checkpoints if genome_id}
+        if done <= genomes:
+            return done
+
+        # Keep the rows of the genomes still asked for, by checkpoint segment
+        kept = self.partial.with_name(f"{self.partial.name}.kept")
+        with (
+            open(self.partial, "rb") as old,
+            open(kept, "wb", buffering=BUFFER_SIZE) as new,
+            open(self.checkpoint, "w", encoding=ENCODING) as ckpt,
+        ):
+            start = 0
+            for genome_id, end in checkpoints:
+                segment = old.read(end - start)
+                start = end
+                if genome_id and genome_id not in genomes:
+                    continue
+                new.write(segment)
+                ckpt.write(tsv_line((genome_id, str(new.tell()))))
+        kept.replace(self.partial)
+
+        return done & genomes
+
+    def put(self, result):
+        self.queue.put(result)
+
+    def run(self):
+        try:
+            self.write()
+        except Exception as err:
+            self.error = err
+            while self.queue.get() is not None:  # unblock the producer
+                pass
+
+    def write(self):
+        with (
+            open(self.partial, "ab", buffering=BUFFER_SIZE) as tsv,
+            open(self.checkpoint, "a", encoding=ENCODING) as ckpt,
+        ):
+            while (result := self.queue.get()) is not None:
+                for genome_id, top_hits in result.items():
+                    for hittup in top_hits:
+                        tsv.write(tsv_line(hittup).encode(ENCODING))
+                    tsv.flush()
+                    ckpt.write(tsv_line((genome_id, str(tsv.tell()))))
+                    ckpt.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+        self.partial.replace(self.out_file)
+        self.checkpoint.unlink()
+
+
+def task_name(result):
+    # A genome, or the genomes of a batch
+    genomes = list(result)
+    if len(genomes) == 1:
+        return genomes[0]
+    return f"{genomes[0]} +{len(genomes) - 1}" if genomes else "empty"
+
+
+def count_hits(result):
+    return sum(len(top_hits) for top_hits in result.values())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Search HMM profiles against genome proteomes."
+    )
+    parser.add_argument("queries", help="Directory of .hmm profiles")
+    parser.add_argument("genomes", help="genomes.tsv with a faa_path column")
+    parser.add_argument("output", help="Output TSV")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each genome as it finishes, resuming from a checkpoint",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Reuse per-genome hits keyed by genome, proteome and queries hashes",
+    )
+    parser.add_argument(
+        "--batch-residues",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Search several genomes per call, up to about N residues (0: off)",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=os.cpu_count(),
+        help="Cores to use (default: all)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=EXECUTORS,
+        default="process",
+        help="process: one genome per core; thread: pyhmmer threads per genome",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="DIR",
+        help="Read the proteomes from a packed genome store (see genome_store.py)",
+    )
+    return parser.parse_args()
 
-    merged = {}
-    for result in results:
-        merged |= result
 
-    with open(OUT_FILE, "w") as tsv:
-        w = lambda itsv: "\t".join(itsv) + "\n"
-
-        tsv.write(w(FIELDS))
-
-        for genome_id in merged:
-            top_hits = merged[genome_id]
+if __name__ == "__main__":
 
-            for hittup in top_hits:
-                tsv.write(w(hittup))
+    args = parse_args()
+    QUERIES_DIR = Path(args.queries)
+    GENOMES_FILE = args.genomes
+    OUT_FILE = Path(args.output)
+
+    with Stage("hmmer") as stage:
+        genomes_paths = pd.read_table(GENOMES_FILE).faa_path
+
+        hmms_files = get_hmms(QUERIES_DIR)
+        hmms = list(hmms_files)
+
+        cache = None
+        if args.cache:
+            cache = HitsCache(args.cache, hash_hmms(hmms_files))
+
+        if args.stream:
+            writer = StreamWriter(OUT_FILE, set(map(parse_genome, genomes_paths)))
+            genomes_paths = [
+                p for p in genomes_paths if parse_genome(p) not in writer.done
+            ]
+            print(
+                f"Resuming: {len(writer.done)} genomes done, "
+                f"{len(genomes_paths)} left.",
+                file=sys.stderr,
+            )
+
+        if args.batch_residues > 0:
+            worker = partial(run_batch, cache=cache)
+            if args.store:
+                with GenomeStore(args.store) as store:
+                    getsize = lambda p: store.size(parse_genome(p), "faa")
+                    tasks = batch_genomes(genomes_paths, args.batch_residues, getsize)
+            else:
+                tasks = batch_genomes(genomes_paths, args.batch_residues)
+        else:
+            worker = partial(run_genome, cache=cache)
+            tasks = genomes_paths
+
+        # Time of each task, to spot the genomes that stall the pool
+        results = search(
+            timed(worker), tasks, hmms, args.cpus, args.executor, args.store
+        )
+
+        if args.stream:
+            writer.start()
+
+            for result, seconds in results:
+                stage.item(task_name(result), seconds, count_hits(result))
+                writer.put(result)
+
+            writer.close()
+
+        else:
+            merged = {}
+            for result, seconds in results:
+                stage.item(task_name(result), seconds, count_hits(result))
+                merged |= result
+
+            with open(OUT_FILE, "w") as tsv:
+                w = tsv_line
+
+                tsv.write(w(FIELDS))
+
+                for genome_id in merged:
+                    top_hits = merged[genome_id]
+
+                    for hittup in top_hits:
+                        tsv.write(w(hittup))
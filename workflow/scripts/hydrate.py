@@ -1,41 +1,51 @@
 #!/usr/bin/env python
 
+import asyncio
 import os
 import re
+import sqlite3
 import subprocess as sp
 import sys
-from multiprocessing import Pool
+from collections import deque
+from itertools import count
 from pathlib import Path
-from random import randint
+from random import uniform
 from shutil import rmtree
-from time import sleep
+from time import monotonic, time
 
-import numpy as np
 import pandas as pd
 
+from genome_store import GenomeStore
+from perf import Stage
+
 CPUS = int(sys.argv[1])
 OUT_DIR = Path(sys.argv[2])
 IN = Path(sys.argv[3])  # A tsv with a header with genome col
+USE_STORE = "--store" in sys.argv[4:]  # pack genomes instead of loose files
 
 COMPRESS = False
 GENOMES_REGEX = r"(GC[AF]_\d+\.\d)"
 
+# Batch size adapts: doubles after a clean batch, halves after a failure
 BATCH_SIZE = 256
-MAX_TRIES = 256
-CHECK_PROGRESS = 8
-OVERWORK = 10
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 1024
+MAX_TRIES = 8  # per batch
+BACKOFF = 2  # seconds, doubles on each retry
+MAX_BACKOFF = 300
+OVERWORK = 10  # concurrent batches per CPU
 
 BATCHES_DIR = Path(f"{OUT_DIR}/batches")
 
 NOT_FOUND = Path(f"{OUT_DIR}/not_found.tsv")
-NOT_FOUND_TXT = Path(f"{OUT_DIR}/.not_found.txt")
-NOT_FOUND_TXT.unlink(missing_ok=True)
-
 GENOMES = Path(f"{OUT_DIR}/genomes.tsv")
-GENOMES_TXT = Path(f"{OUT_DIR}/.genomes.txt")
-GENOMES_TXT.unlink(missing_ok=True)
+MANIFEST = Path(f"{OUT_DIR}/.manifest.db")
+STORE_DIR = Path(f"{OUT_DIR}/store")
+STORE = None  # GenomeStore, opened on main when USE_STORE
 
 KEY = os.environ.setdefault("NCBI_DATASETS_APIKEY", "")
+# NCBI allows 3 requests per second, 10 with an API key
+RATE = 10 if KEY else 3
 
 ENCODING = "utf-8"
 
@@ -44,7 +54,9 @@ DEHYDRATE_LAG = ["--dehydrated", "--include", "protein,gff3", "--api-key", f"{KE
 REHYDRATE_LEAD = ["datasets", "rehydrate", "--api-key", f"{KEY}"]
 
 
-def sort_filter_genomes(inpath: Path, outpath: Path, only_refseq: bool) -> list[str]:
+def sort_filter_genomes(
+    genomes: list[str], outpath: Path, only_refseq: bool
+) -> list[str]:
     """
     Given a input genome list (genome assembly accessions).
     Generate a python list with valid ids.
@@ -61,7 +73,7 @@ def sort_filter_genomes(inpath: Path, outpath: Path, only_refseq: bool) -> list[
     def remove_comments(x: str) -> str:
         return re.sub(r"#.*$", "", x).strip()
 
-    df = pd.read_table(inpath, names=("genome",), sep="\t")
+    df = pd.DataFrame({"genome": list(genomes)}, dtype=str)
     df.genome = df.genome.apply(remove_comments)
 
     genome_matches = [bool(re.match(GENOMES_REGEX, g)) for g in df.genome]
@@ -85,9 +97,112 @@ def sort_filter_genomes(inpath: Path, outpath: Path, only_refseq: bool) -> list[
     return list(df.genome)
 
 
-def worker(idx, genomes):
-    sleep(0.1 + randint(0, 3))  # Avoids getting blocked by NCBI servers
+class Manifest:
+    """
+    SQLite log of every genome seen by the downloader.
+
+    One row per genome with its status ("done" or "not_found"),
+    the sizes and md5 sums of its .faa and .gff,
+    and how it was saved, `mode` ("store" or "loose").
+    Restarts ask it for the genomes completed in their mode
+    instead of checking every genome directory.
+    Delete it to force a rescan of the genome directories.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS genomes (
+            genome TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            faa_size INTEGER,
+            gff_size INTEGER,
+            faa_md5 TEXT,
+            gff_md5 TEXT,
+            updated REAL,
+            mode TEXT
+        )
+    """
+
+    def __init__(self, path: Path, mode: str):
+        self.mode = mode
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(self.SCHEMA)
+
+        # Manifests written before the mode column, their rows are rescanned
+        columns = [col[1] for col in self.conn.execute("PRAGMA table_info(genomes)")]
+        if "mode" not in columns:
+            self.conn.execute("ALTER TABLE genomes ADD COLUMN mode TEXT")
+
+    def completed(self) -> set[str]:
+        rows = self.conn.execute(
+            "SELECT genome FROM genomes WHERE status = 'done' AND mode = ?",
+            (self.mode,),
+        )
+        return {genome for (genome,) in rows}
+
+    def record(self, rows: list[tuple]):
+        # (genome, status, faa_size, gff_size, faa_md5, gff_md5)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO genomes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row + (time(), self.mode) for row in rows],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def read_md5sums(batch_dir: Path) -> dict[str, str]:
+    md5sums = {}
+    try:
+        with open(batch_dir / "md5sum.txt", encoding=ENCODING) as h:
+            for line in h:
+                if len(fields := line.split()) == 2:
+                    md5, path = fields
+                    md5sums[path] = md5
+    except FileNotFoundError:
+        pass
+    return md5sums
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by all the batches.
+    Every `datasets` call takes a token; tokens refill at `rate` per second.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def run(cmd: list[str], **kwargs):
+    proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+    returncode = await proc.wait()
+    if returncode != 0:
+        raise sp.CalledProcessError(returncode, cmd)
+
+
+async def hydrate_batch(
+    idx, genomes, bucket: TokenBucket, manifest: Manifest
+) -> list[str]:
     unsuccessful_genomes = []
+    completed = []
 
     batch_dir = BATCHES_DIR / str(idx)
     batch_zip = batch_dir / f"{idx}.zip"
@@ -103,14 +218,18 @@ def worker(idx, genomes):
 
         # Batch Processing
         batch_dir.mkdir(parents=True)
-        sp.run(dehydrate_cmd, check=True)
-        sp.run(unzip_cmd, check=True)
-        sp.run(rehydrate_cmd, check=True)
-        sp.run(md5sum_cmd, check=True, cwd=batch_dir)
+        await bucket.acquire()
+        await run(dehydrate_cmd)
+        await run(unzip_cmd)
+        await bucket.acquire()
+        await run(rehydrate_cmd)
+        await run(md5sum_cmd, cwd=batch_dir)
 
     except (sp.CalledProcessError, FileExistsError) as err:
         print(err)
 
+    md5sums = read_md5sums(batch_dir)
+
     for genome in genomes:
 
         genome_dir = OUT_DIR / str(genome)
@@ -118,61 +237,167 @@ def worker(idx, genomes):
         faa = batch_dir / "ncbi_dataset" / "data" / genome / "protein.faa"
 
         if gff.is_file() and faa.is_file():
+            gff_md5 = md5sums.get(str(gff.relative_to(batch_dir)))
+            faa_md5 = md5sums.get(str(faa.relative_to(batch_dir)))
+
+            completed.append(
+                (
+                    genome,
+                    "done",
+                    faa.stat().st_size,
+                    gff.stat().st_size,
+                    faa_md5,
+                    gff_md5,
+                )
+            )
+
+            if STORE is not None:
+                await asyncio.to_thread(STORE.put, genome, "faa", faa)
+                await asyncio.to_thread(STORE.put, genome, "gff", gff)
+                continue
+
             genome_dir.mkdir(exist_ok=True)
             gff = gff.rename(genome_dir / f"{genome}.gff")
             faa = faa.rename(genome_dir / f"{genome}.faa")
 
-            with open(GENOMES_TXT, "a", encoding=ENCODING) as h:
-                h.write(str(genome) + "\n")
-
             if COMPRESS:
-                sp.run(
-                    ["pigz", "--processes", str(CPUS), str(gff), str(faa)], check=True
-                )
+                await run(["pigz", "--processes", str(CPUS), str(gff), str(faa)])
         else:
             unsuccessful_genomes.append(genome)
 
+    manifest.record(completed)
+    rmtree(batch_dir, ignore_errors=True)
+
     return unsuccessful_genomes
 
 
-def download(genomes: list[str]):
+class Scheduler:
+    """
+    Download genomes in batches, with at most `concurrency` batches running.
+
+    Fresh batches take `batch_size` genomes, which doubles after a clean batch
+    and halves after a batch with failures (up to MAX_BATCH_SIZE, down to MIN_BATCH_SIZE).
+    The failed genomes of a batch are retried in smaller batches
+    after an exponential backoff, at most MAX_TRIES times.
+
+    `datasets` is looked up in the PATH,
+    so a stub executable can stand in for it when testing.
+    """
+
+    def __init__(
+        self, genomes: list[str], concurrency: int, rate: float, manifest: Manifest
+    ):
+        self.manifest = manifest
+        self.fresh = deque(genomes)
+        self.retries = deque()
+        self.batch_size = BATCH_SIZE
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.ids = count()
+        self.running = 0
+        self.waiting = 0
+        self.unsuccessful = []
+
+    def next_batch(self):
+        if self.retries:
+            return self.retries.popleft()
+        if self.fresh:
+            size = min(self.batch_size, len(self.fresh))
+            return [self.fresh.popleft() for _ in range(size)], 0
+        return None
+
+    def requeue(self, batches):
+        self.waiting -= 1
+        self.retries.extend(batches)
+
+    async def process(self, genomes, tries):
+        unsuccessful = await hydrate_batch(
+            next(self.ids), genomes, self.bucket, self.manifest
+        )
+
+        if not unsuccessful:
+            self.batch_size = min(MAX_BATCH_SIZE, self.batch_size * 2)
+            return
+
+        self.batch_size = max(MIN_BATCH_SIZE, self.batch_size // 2)
+
+        tries += 1
+        if tries >= MAX_TRIES:
+            self.unsuccessful.extend(unsuccessful)
+            return
+
+        size = max(MIN_BATCH_SIZE, min(self.batch_size, len(unsuccessful) // 2))
+        batches = [
+            (unsuccessful[i : i + size], tries)
+            for i in range(0, len(unsuccessful), size)
+        ]
+
+        delay = min(MAX_BACKOFF, BACKOFF * 2**tries) * uniform(0.5, 1.5)
+        print(f"Retrying {len(unsuccessful)} genomes in {delay:.0f}s (try {tries}).")
+
+        self.waiting += 1
+        asyncio.get_running_loop().call_later(delay, self.requeue, batches)
+
+    async def worker(self):
+        while True:
+            batch = self.next_batch()
+
+            if batch is None:
+                if self.running == 0 and self.waiting == 0:
+                    return
+                await asyncio.sleep(0.5)  # retries are backing off
+                continue
+
+            self.running += 1
+            try:
+                await self.process(*batch)
+            finally:
+                self.running -= 1
+
+    async def run(self) -> list[str]:
+        await asyncio.gather(*(self.worker() for _ in range(self.concurrency)))
+        return self.unsuccessful
+
+
+def download(genomes: list[str], manifest: Manifest) -> list[str]:
 
     if len(genomes) == 0:
         return []
 
-    batches = np.array_split(genomes, int(np.ceil(len(genomes) / BATCH_SIZE)))
-    batches = tuple(enumerate(batches))
-
     try:
         rmtree(BATCHES_DIR)
     except FileNotFoundError:
         pass
     BATCHES_DIR.mkdir(parents=True)
 
-    with Pool(CPUS * OVERWORK) as p:
-        results = p.starmap(worker, batches)
+    scheduler = Scheduler(genomes, CPUS * OVERWORK, RATE, manifest)
+    unsuccessful_genomes = asyncio.run(scheduler.run())
 
     rmtree(BATCHES_DIR)
 
-    unsuccessful_genomes = []
-    for result in results:
-        unsuccessful_genomes.extend(result)
-
     return unsuccessful_genomes
 
 
-def is_uncomplete(genome):
-    genome_dir = OUT_DIR / str(genome)
-    if genome_dir.exists():
+def scan_completed(genomes: list[str]) -> list[tuple]:
+    """
+    Manifest rows for genomes already saved in the current mode,
+    but not marked as done in it by the manifest.
+    """
+    rows = []
+    for genome in genomes:
+        if STORE is not None:
+            if genome in STORE:
+                sizes = STORE.size(genome, "faa"), STORE.size(genome, "gff")
+                rows.append((genome, "done", *sizes, None, None))
+            continue
+
+        genome_dir = OUT_DIR / str(genome)
         gff = genome_dir / f"{genome}.gff"
         faa = genome_dir / f"{genome}.faa"
-        complete = gff.exists() and faa.exists()
-        if complete:
-            with open(GENOMES_TXT, "a", encoding=ENCODING) as h:
-                h.write(str(genome) + "\n")
-        return not complete
-    else:
-        return True
+        if gff.is_file() and faa.is_file():
+            row = (genome, "done", faa.stat().st_size, gff.stat().st_size, None, None)
+            rows.append(row)
+    return rows
 
 
 if __name__ == "__main__":
@@ -185,22 +410,30 @@ if __name__ == "__main__":
                 genomes.append(genome)
 
     genomes = list(set(genomes))  # rm duplications
-    genomes = list(filter(is_uncomplete, genomes))  # rm already downloaded
-
-    remaining_genomes = genomes
-    for i in range(MAX_TRIES):
-        remaining_genomes = download(remaining_genomes)
-        if i == 0:
-            last = remaining_genomes
-        elif (
-            not remaining_genomes or remaining_genomes == last
-        ) and i % CHECK_PROGRESS == 0:
-            break
-        last = remaining_genomes
-
-    with open(NOT_FOUND_TXT, "w", encoding=ENCODING) as h:
-        for g in remaining_genomes:
-            h.write(str(g) + "\n")
-
-    sort_filter_genomes(GENOMES_TXT, GENOMES, only_refseq=False)
-    sort_filter_genomes(NOT_FOUND_TXT, NOT_FOUND, only_refseq=False)
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    if USE_STORE:
+        STORE = GenomeStore(STORE_DIR, writable=True)
+
+    manifest = Manifest(MANIFEST, "store" if USE_STORE else "loose")
+    completed = manifest.completed()
+    manifest.record(scan_completed([g for g in genomes if g not in completed]))
+
+    completed = manifest.completed()
+    genomes_todo = [g for g in genomes if g not in completed]  # rm already downloaded
+
+    with Stage("download_genomes") as stage:
+        remaining_genomes = download(genomes_todo, manifest)
+        stage.add(len(genomes_todo) - len(remaining_genomes))
+    manifest.record(
+        [(g, "not_found", None, None, None, None) for g in remaining_genomes]
+    )
+
+    completed = manifest.completed()
+    manifest.close()
+    if STORE is not None:
+        STORE.close()
+
+    downloaded = [g for g in genomes if g in completed]
+    sort_filter_genomes(downloaded, GENOMES, only_refseq=False)
+    sort_filter_genomes(remaining_genomes, NOT_FOUND, only_refseq=False)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+InterProScan annotation cache keyed by sequence MD5.
+
+The same protein (e.g. a WP_ accession) shows up in many genomes and
+many runs, so its InterProScan rows are kept in an SQLite cache under
+the MD5 of its sequence.
+
+unseen: write the proteins of all.faa whose sequence is not cached yet,
+        one per distinct sequence, for InterProScan to annotate.
+
+merge:  add the fresh InterProScan rows to the cache, and write the rows
+        of every protein in all.faa, cached or fresh, as .iscan_raw.tsv.
+
+The cache does not know the InterProScan version;
+delete it after upgrading InterProScan or its member databases.
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from perf import Stage
+from split_faa import read_records
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS seqs (
+        md5 TEXT PRIMARY KEY
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS hits (
+        md5 TEXT NOT NULL,
+        line TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_hits_md5 ON hits (md5);
+"""
+
+
+def connect(cache_db: str) -> sqlite3.Connection:
+    Path(cache_db).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(cache_db, timeout=300.0)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def hashed_records(in_faa: str) -> Iterator[Tuple[str, str, bytes]]:
+    """
+    Yield (pid, md5, record) for every protein.
+    The MD5 is the one InterProScan reports: of the uppercase sequence.
+    """
+    for lines, _ in read_records(Path(in_faa)):
+        pid = lines[0][1:].split(None, 1)[0].decode()
+        seq = b"".join(line.rstrip() for line in lines[1:]).upper()
+        yield pid, hashlib.md5(seq).hexdigest(), b"".join(lines)
+
+
+def unseen(cache_db: str, in_faa: str, out=None) -> int:
+    """
+    Write the records whose sequence is not in the cache, once per sequence.
+
+    Args:
+        cache_db: Path to the SQLite cache.
+        in_faa: all.faa.
+        out: Binary output stream, stdout by default.
+
+    Returns:
+        Number of proteins read.
+    """
+    out = sys.stdout.buffer if out is None else out
+    conn = connect(cache_db)
+
+    total, written = 0, set()
+    for pid, md5, record in hashed_records(in_faa):
+        total += 1
+        if md5 in written:
+            continue
+        if conn.execute("SELECT 1 FROM seqs WHERE md5 = ?", (md5,)).fetchone():
+            continue
+        written.add(md5)
+        out.write(record)
+
+    conn.close()
+    print(f"{len(written)} of {total} proteins need InterProScan.", file=sys.stderr)
+    return total
+
+
+def merge(cache_db: str, in_faa: str, unseen_faa: str, iscan_tsv: str, out=None) -> int:
+    """
+    Cache the rows of iscan_tsv and write the rows of every protein in in_faa.
+
+    Args:
+        cache_db: Path to the SQLite cache.
+        in_faa: all.faa.
+        unseen_faa: The proteins that were sent to InterProScan.
+        iscan_tsv: InterProScan TSV output for unseen_faa.
+        out: Text output stream, stdout by default.
+
+    Returns:
+        Number of rows written.
+    """
+    out = sys.stdout if out is None else out
+    conn = connect(cache_db)
+
+    md5s = {pid: md5 for pid, md5, _ in hashed_records(unseen_faa)}
+
+    rows = []
+    with open(iscan_tsv, encoding="utf-8") as h:
+        for line in h:
+            pid, rest = line.rstrip("\n").split("\t", 1)
+            rows.append((md5s[pid], rest))
+
+    # The rows of a sequence replace any cached ones, so a rerun adds nothing
+    with conn:
+        fresh = [(md5,) for md5 in set(md5s.values())]
+        conn.executemany("DELETE FROM hits WHERE md5 = ?", fresh)
+        conn.executemany("INSERT OR IGNORE INTO seqs VALUES (?)", fresh)
+        conn.executemany("INSERT INTO hits VALUES (?, ?)", rows)
+
+    print(f"Cached {len(rows)} rows for {len(md5s)} sequences.", file=sys.stderr)
+
+    n_rows = 0
+    for pid, md5, _ in hashed_records(in_faa):
+        for (rest,) in conn.execute("SELECT line FROM hits WHERE md5 = ?", (md5,)):
+            out.write(f"{pid}\t{rest}\n")
+            n_rows += 1
+
+    conn.close()
+    return n_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="InterProScan annotation cache keyed by sequence MD5."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_unseen = sub.add_parser("unseen", help="Write the proteins not cached yet")
+    p_unseen.add_argument("cache_db", help="SQLite cache, created if missing")
+    p_unseen.add_argument("in_faa", help="all.faa")
+
+    p_merge = sub.add_parser("merge", help="Cache new rows and write all of them")
+    p_merge.add_argument("cache_db", help="SQLite cache, created if missing")
+    p_merge.add_argument("in_faa", help="all.faa")
+    p_merge.add_argument("unseen_faa", help="Proteins sent to InterProScan")
+    p_merge.add_argument("iscan_tsv", help="InterProScan TSV for unseen_faa")
+
+    args = parser.parse_args()
+
+    with Stage(f"iscan_{args.command}") as stage:
+        if args.command == "unseen":
+            stage.add(unseen(args.cache_db, args.in_faa))
+        elif args.command == "merge":
+            stage.add(
+                merge(args.cache_db, args.in_faa, args.unseen_faa, args.iscan_tsv)
+            )
+
+
+if __name__ == "__main__":
+    main()
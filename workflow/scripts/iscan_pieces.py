@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Run InterProScan on the .faa pieces of split_faa.py, several at a time.
+
+One InterProScan run spends a good part of its time starting Java and in
+serial stages, so a single run rarely keeps all the cores busy.
+Here up to --jobs runs go at once, each with cpus / jobs cores.
+
+A piece is skipped when its TSV is newer than the piece,
+so a rerun after a failure only annotates what is left.
+Failed pieces are retried; if some still fail, the rest finish and
+the script exits with an error listing them.
+Each run logs to {out_dir}/{piece}.log and the time per piece is
+written to {out_dir}/timing.tsv.
+"""
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from time import perf_counter
+from typing import List, Tuple
+
+from perf import Stage
+
+BUFFER_SIZE = 1 << 20  # bytes
+
+
+def piece_key(faa: Path):
+    return (0, int(faa.stem)) if faa.stem.isdigit() else (1, faa.stem)
+
+
+def tsv_path(out_dir: Path, faa: Path) -> Path:
+    return out_dir / f"{faa.name}.tsv"
+
+
+def is_done(out_dir: Path, faa: Path) -> bool:
+    tsv = tsv_path(out_dir, faa)
+    return tsv.exists() and tsv.stat().st_mtime_ns >= faa.stat().st_mtime_ns
+
+
+def run_piece(
+    faa: Path, out_dir: Path, cmd: str, cpus: int, tmp: Path, retries: int
+) -> Tuple[str, float, int, bool]:
+    """
+    Annotate one piece, retrying on failure.
+
+    Returns:
+        (piece, seconds, tries, ok)
+    """
+    tsv = tsv_path(out_dir, faa)
+    partial = out_dir / f".{tsv.name}.partial"
+    log = out_dir / f"{faa.name}.log"
+
+    args = shlex.split(cmd) + [
+        "--input",
+        str(faa),
+        "--cpu",
+        str(cpus),
+        "--tempdir",
+        str(tmp),
+        "--goterms",
+        "--enable-tsv-residue-annot",
+        "-dp",
+        "-f",
+        "TSV",
+        "-o",
+        str(partial),
+    ]
+
+    start = perf_counter()
+    for tries in range(1, retries + 2):
+        with open(log, "a") as h_log:
+            print(f"# try {tries}: {shlex.join(args)}", file=h_log, flush=True)
+            returncode = subprocess.run(
+                args, stdout=h_log, stderr=subprocess.STDOUT
+            ).returncode
+        if returncode == 0 and partial.exists():
+            os.replace(partial, tsv)
+            return faa.name, perf_counter() - start, tries, True
+        partial.unlink(missing_ok=True)
+
+    return faa.name, perf_counter() - start, tries, False
+
+
+def concat(tsvs: List[Path], output: str) -> None:
+    with open(output, "wb") as out:
+        for tsv in tsvs:
+            with open(tsv, "rb") as h:
+                while chunk := h.read(BUFFER_SIZE):
+                    out.write(chunk)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run InterProScan on FASTA pieces in parallel."
+    )
+    parser.add_argument("in_dir", help="Directory with the .faa pieces")
+    parser.add_argument("out_dir", help="Directory for the per-piece TSVs and logs")
+    parser.add_argument("output", help="All the TSVs, concatenated in piece order")
+    parser.add_argument("--cmd", default="interproscan.sh", help="InterProScan command")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="InterProScan runs at the same time"
+    )
+    parser.add_argument("--tempdir", default="temp", help="InterProScan --tempdir")
+    parser.add_argument("--retries", type=int, default=2, help="Extra tries per piece")
+    args = parser.parse_args()
+
+    in_dir, out_dir, tmp = Path(args.in_dir), Path(args.out_dir), Path(args.tempdir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp.mkdir(parents=True, exist_ok=True)
+
+    pieces = sorted(in_dir.glob("*.faa"), key=piece_key)
+    if not pieces:
+        print("All proteins are in the InterProScan cache.", file=sys.stderr)
+        concat([], args.output)
+        return
+
+    todo = [faa for faa in pieces if not is_done(out_dir, faa)]
+    jobs = max(1, min(args.jobs, len(todo), args.cpus))
+    cpus = max(1, args.cpus // jobs)
+    print(
+        f"{len(todo)} of {len(pieces)} pieces to annotate, "
+        f"{jobs} at a time with {cpus} cpus each.",
+        file=sys.stderr,
+    )
+
+    failed = []
+    with Stage("interproscan") as stage, open(out_dir / "timing.tsv", "a") as h_timing:
+        if h_timing.tell() == 0:
+            print("piece\tseconds\ttries\tok", file=h_timing)
+
+        with ThreadPoolExecutor(jobs) as executor:
+            futures = [
+                executor.submit(
+                    run_piece, faa, out_dir, args.cmd, cpus, tmp, args.retries
+                )
+                for faa in todo
+            ]
+            for i, future in enumerate(as_completed(futures)):
+                piece, seconds, tries, ok = future.result()
+                print(
+                    f"{piece}\t{seconds:.1f}\t{tries}\t{ok}", file=h_timing, flush=True
+                )
+                status = "done" if ok else "FAILED"
+                print(
+                    f"  {i + 1}/{len(todo)} {piece} {status} "
+                    f"in {seconds:.1f}s ({tries} tries)",
+                    file=sys.stderr,
+                )
+                stage.item(piece, seconds)
+                if not ok:
+                    failed.append(piece)
+
+    if failed:
+        print(
+            f"CRITICAL: InterProScan failed for {', '.join(sorted(failed))}, "
+            f"see the logs in {out_dir}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    concat([tsv_path(out_dir, faa) for faa in pieces], args.output)
+
+
+if __name__ == "__main__":
+    main()
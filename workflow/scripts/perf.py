@@ -0,0 +1,191 @@
+"""
+Performance records of the Python stages, as JSON lines.
+
+    with Stage("hmmer") as stage:
+        for (genome, hits), seconds in pool.imap_unordered(timed(worker), tasks):
+            stage.item(genome, seconds, len(hits))
+
+When the block ends, a stage appends to the file named by $PANDOOMAIN_PERF
+(set by the Snakefile to {results}/benchmarks/stages.jsonl):
+
+    {"kind": "stage", "run", "stage", "status", "wall_s", "cpu_s",
+     "max_rss_mb", "records", "records_per_s", "items", "item_median_s",
+     "item_max_s", "argv", "host", "pid", "started"}
+    {"kind": "outlier", "run", "stage", "item", "seconds", "records",
+     "median_s", "ratio"}
+
+with one outlier line per item (a genome, a piece, a shard) that took
+more than OUTLIER_RATIO times the median item, and OUTLIER_MIN_S or more.
+CPU time and peak RSS include the child processes waited for, like the
+workers of a Pool. $PANDOOMAIN_RUN tags the lines of a pipeline run.
+The summary is also printed to stderr, with or without $PANDOOMAIN_PERF.
+
+See utils/perf_report.py for the per-run table.
+"""
+
+import json
+import os
+import resource
+import socket
+import sys
+from datetime import datetime
+from functools import partial
+from statistics import median
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
+PERF_ENV = "PANDOOMAIN_PERF"
+RUN_ENV = "PANDOOMAIN_RUN"
+
+OUTLIER_RATIO = 5.0
+OUTLIER_MIN_S = 1.0
+MAX_OUTLIERS = 20  # per stage, the slowest
+
+
+def cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux, and in bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return (
+        max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        / scale
+    )
+
+
+def _call_timed(func: Callable, *args, **kwargs):
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+def timed(func: Callable) -> Callable:
+    """
+    Wrap func to return (result, seconds); picklable for Pool workers
+    when func is.
+    """
+    return partial(_call_timed, func)
+
+
+class Stage:
+    """
+    Measure a stage of the pipeline, from __enter__ to __exit__.
+
+    Args:
+        name: Stage name, usually the script or rule.
+        path: JSON lines file, $PANDOOMAIN_PERF by default.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None):
+        self.name = name
+        self.path = os.environ.get(PERF_ENV) if path is None else path
+        self.records = 0
+        self.items: List[Tuple[str, float, Optional[int]]] = []
+
+    def __enter__(self):
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.start_wall = perf_counter()
+        self.start_cpu = cpu_seconds()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        status = "ok"
+        if exc_type is not None and not (
+            exc_type is SystemExit and exc.code in (None, 0)
+        ):
+            status = "error"
+        self.write(status)
+
+    def add(self, records: int) -> None:
+        """
+        Count records (rows, proteins, hits) for records_per_s.
+        """
+        self.records += records
+
+    def item(self, name: str, seconds: float, records: Optional[int] = None) -> None:
+        """
+        Time of one unit of work, and its records, also added to the stage.
+        """
+        self.items.append((name, seconds, records))
+        if records is not None:
+            self.records += records
+
+    def outliers(self) -> List[dict]:
+        if len(self.items) < 2:
+            return []
+        typical = median(seconds for _, seconds, _ in self.items)
+        slow = [
+            (name, seconds, records)
+            for name, seconds, records in self.items
+            if seconds >= OUTLIER_MIN_S and seconds > OUTLIER_RATIO * typical
+        ]
+        slow.sort(key=lambda item: -item[1])
+        return [
+            {
+                "kind": "outlier",
+                "run": os.environ.get(RUN_ENV),
+                "stage": self.name,
+                "item": name,
+                "seconds": round(seconds, 3),
+                "records": records,
+                "median_s": round(typical, 3),
+                "ratio": round(seconds / typical, 1) if typical > 0 else None,
+            }
+            for name, seconds, records in slow[:MAX_OUTLIERS]
+        ]
+
+    def summary(self, status: str) -> dict:
+        wall = perf_counter() - self.start_wall
+        times = [seconds for _, seconds, _ in self.items]
+        return {
+            "kind": "stage",
+            "run": os.environ.get(RUN_ENV),
+            "stage": self.name,
+            "status": status,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu_seconds() - self.start_cpu, 3),
+            "max_rss_mb": round(max_rss_mb(), 1),
+            "records": self.records,
+            "records_per_s": round(self.records / wall, 1) if wall > 0 else None,
+            "items": len(self.items),
+            "item_median_s": round(median(times), 3) if times else None,
+            "item_max_s": round(max(times), 3) if times else None,
+            "argv": sys.argv,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": self.started,
+        }
+
+    def write(self, status: str) -> None:
+        summary = self.summary(status)
+        outliers = self.outliers()
+
+        print(
+            f"[perf] {self.name}: {summary['wall_s']:.1f}s wall, "
+            f"{summary['cpu_s']:.1f}s cpu, {summary['max_rss_mb']:.0f} MiB peak, "
+            f"{self.records} records, {len(outliers)} slow items",
+            file=sys.stderr,
+        )
+        for outlier in outliers:
+            print(
+                f"[perf]   {outlier['item']}: {outlier['seconds']:.1f}s "
+                f"(median {outlier['median_s']:.2f}s)",
+                file=sys.stderr,
+            )
+
+        if not self.path:
+            return
+        lines = "".join(json.dumps(line) + "\n" for line in [summary, *outliers])
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # A single append, so stages running at once do not interleave lines
+        with open(self.path, "a") as h:
+            h.write(lines)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Protein index of the downloaded genomes, and all.faa extraction.
+
+build:   record, for every protein of every genome, the byte offset and
+         length of its FASTA record in the genome's .faa.
+         Genomes already indexed (same .faa size and mtime, or same
+         sha256 in a packed store) are skipped,
+         so reruns only index new or re-downloaded genomes.
+
+extract: copy the records of the proteins listed in a table with
+         genome and pid columns (neighbors.tsv) into a FASTA file,
+         reading only those records from memory-mapped .faa files,
+         or from their blocks in a packed store.
+"""
+
+import argparse
+import mmap
+import os
+import re
+import sqlite3
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import pandas as pd
+
+from genome_store import GenomeStore
+from perf import Stage, timed
+
+HEADER_REGEX = re.compile(rb"^>(\S+)", re.MULTILINE)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS genomes (
+        genome TEXT PRIMARY KEY,
+        stamp TEXT NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS proteins (
+        pid TEXT NOT NULL,
+        genome TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (pid, genome)
+    ) WITHOUT ROWID;
+"""
+
+# Set per worker, see init_worker
+STORE = None
+
+
+def init_worker(store: Optional[str]) -> None:
+    global STORE
+    if store is not None:
+        STORE = GenomeStore(store)
+
+
+def faa_path(genomes_dir: Path, genome: str) -> Path:
+    return genomes_dir / genome / f"{genome}.faa"
+
+
+def records(faa) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yield (pid, offset, length) for every record of a FASTA buffer.
+    """
+    starts = [(m.group(1).decode(), m.start()) for m in HEADER_REGEX.finditer(faa)]
+    for i, (pid, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else len(faa)
+        yield pid, start, end - start
+
+
+def index_genome(task: Tuple[str, str]) -> Tuple[str, List[Tuple]]:
+    genome, path = task
+
+    if STORE is not None:
+        faa = STORE.get(genome, "faa")
+        return genome, [(pid, genome, o, n) for pid, o, n in records(faa)]
+
+    with open(path, "rb") as h:
+        if os.fstat(h.fileno()).st_size == 0:
+            return genome, []
+        with mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ) as faa:
+            return genome, [(pid, genome, o, n) for pid, o, n in records(faa)]
+
+
+def stamp(genomes_dir: Path, genome: str) -> str:
+    if STORE is not None:
+        return STORE.sha256(genome, "faa")
+    stat = faa_path(genomes_dir, genome).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def build(
+    genomes_tsv: str, index_db: str, cpus: int, store: Optional[str] = None
+) -> List[Tuple[str, float, int]]:
+    """
+    Index the proteins of every genome listed in genomes.tsv.
+
+    Args:
+        genomes_tsv: genomes.tsv written by hydrate.py.
+        index_db: Path to the SQLite index, updated in place.
+        cpus: Number of indexing processes.
+        store: Packed genome store to read instead of loose files.
+
+    Returns:
+        (genome, seconds, proteins) of each genome indexed.
+    """
+    genomes_dir = Path(genomes_tsv).parent
+    genomes = list(pd.read_table(genomes_tsv, usecols=["genome"]).genome)
+
+    init_worker(store)
+
+    conn = sqlite3.connect(index_db)
+    conn.executescript(SCHEMA)
+    known = dict(conn.execute("SELECT genome, stamp FROM genomes"))
+
+    todo = {}
+    for genome in genomes:
+        current = stamp(genomes_dir, genome)
+        if known.get(genome) != current:
+            todo[genome] = current
+
+    print(f"Indexing {len(todo)} of {len(genomes)} genomes...")
+
+    tasks = [(g, str(faa_path(genomes_dir, g))) for g in todo]
+    n_proteins = 0
+    timings = []
+    with Pool(cpus, initializer=init_worker, initargs=(store,)) as pool:
+        results = pool.imap_unordered(timed(index_genome), tasks)
+        for i, ((genome, rows), seconds) in enumerate(results):
+            with conn:
+                conn.execute("DELETE FROM proteins WHERE genome = ?", (genome,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO proteins VALUES (?, ?, ?, ?)", rows
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO genomes VALUES (?, ?)",
+                    (genome, todo[genome]),
+                )
+            n_proteins += len(rows)
+            timings.append((genome, seconds, len(rows)))
+            print(f"  {i + 1}/{len(tasks)} genomes", end="\r")
+
+    print(f"\nIndexed {n_proteins} proteins.")
+    conn.close()
+    return timings
+
+
+def rewrap(record: bytes, width: int) -> bytes:
+    """
+    Wrap the sequence of a record to width, unless it already is.
+    """
+    lines = record.rstrip(b"\n").split(b"\n")
+    header, seq_lines = lines[0], lines[1:]
+
+    if all(len(line) == width for line in seq_lines[:-1]) and (
+        not seq_lines or len(seq_lines[-1]) <= width
+    ):
+        return record if record.endswith(b"\n") else record + b"\n"
+
+    seq = b"".join(seq_lines)
+    wrapped = [seq[i : i + width] for i in range(0, len(seq), width)]
+    return b"\n".join([header] + wrapped) + b"\n"
+
+
+def extract(
+    index_db: str,
+    table: str,
+    genomes_dir: str,
+    width: int,
+    out=None,
+    store: Optional[str] = None,
+) -> int:
+    """
+    Write the FASTA records of the proteins in table, sorted by header.
+
+    Args:
+        index_db: SQLite index made by build.
+        table: TSV with genome and pid columns.
+        genomes_dir: Directory with the {genome}/{genome}.faa files.
+        width: Sequence line width.
+        out: Binary output stream, stdout by default.
+        store: Packed genome store to read instead of loose files.
+
+    Returns:
+        Number of records written.
+    """
+    out = sys.stdout.buffer if out is None else out
+    genomes_dir = Path(genomes_dir)
+
+    wanted = pd.read_table(table, usecols=["genome", "pid"]).dropna()
+    wanted = wanted.drop_duplicates("pid")
+
+    conn = sqlite3.connect(f"file:{quote(index_db)}?mode=ro", uri=True)
+    init_worker(store)
+
+    found = []
+    missing = 0
+    for genome, group in wanted.groupby("genome", sort=False):
+        if STORE is not None:
+            # Each record from its block of the store, see GenomeStore.protein
+            for pid in group.pid:
+                if (record := STORE.protein(genome, pid)) is None:
+                    missing += 1
+                else:
+                    found.append(record)
+            continue
+
+        locations = []
+        for pid in group.pid:
+            row = conn.execute(
+                "SELECT offset, length FROM proteins WHERE pid = ? AND genome = ?",
+                (pid, genome),
+            ).fetchone()
+            if row is None:
+                missing += 1
+            else:
+                locations.append(row)
+
+        if not locations:
+            continue
+
+        with open(faa_path(genomes_dir, genome), "rb") as h:
+            with mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ) as faa:
+                found.extend(faa[o : o + n] for o, n in locations)
+
+    conn.close()
+
+    if missing:
+        print(f"WARNING: {missing} proteins not found in the index.", file=sys.stderr)
+
+    found.sort(key=lambda record: record.split(b"\n", 1)[0])
+    for record in found:
+        out.write(rewrap(record, width))
+    return len(found)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Index genome proteins and extract them into all.faa."
+    )
+    parser.add_argument("--store", help="Packed genome store (see genome_store.py)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Index the proteins of the genomes")
+    p_build.add_argument("genomes_tsv", help="genomes.tsv written by hydrate.py")
+    p_build.add_argument("index_db", help="SQLite index, updated in place")
+    p_build.add_argument("--cpus", type=int, default=os.cpu_count())
+
+    p_extract = sub.add_parser("extract", help="Write the listed proteins as FASTA")
+    p_extract.add_argument("index_db", help="SQLite index made by build")
+    p_extract.add_argument("table", help="TSV with genome and pid columns")
+    p_extract.add_argument("--genomes-dir", required=True)
+    p_extract.add_argument("--width", type=int, default=80)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with Stage("index_proteins") as stage:
+            for genome, seconds, n_proteins in build(
+                args.genomes_tsv, args.index_db, args.cpus, args.store
+            ):
+                stage.item(genome, seconds, n_proteins)
+    elif args.command == "extract":
+        with Stage("all_faa") as stage:
+            stage.add(
+                extract(
+                    args.index_db,
+                    args.table,
+                    args.genomes_dir,
+                    args.width,
+                    store=args.store,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
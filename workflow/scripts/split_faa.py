@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Split a FASTA file into pieces for InterProScan.
+
+Records are streamed as raw bytes and cut on '>' boundaries,
+either every N records or every N residues.
+Sequence lines are copied as they are when already wrapped at the
+requested width, and rewrapped otherwise.
+
+With --balance the number of pieces is fixed first
+(records / batch size) and each record goes to the piece with the
+fewest residues so far, so the pieces take roughly the same time.
+A record longer than --residues gets a piece of its own,
+and no piece is left empty.
+"""
+
+import argparse
+import heapq
+import sys
+from datetime import datetime
+from pathlib import Path
+from shutil import rmtree
+from typing import Iterator, List, Tuple
+
+from perf import Stage
+from pid_index import rewrap
+
+BUFFER_SIZE = 1 << 20  # bytes
+
+
+def read_records(in_faa: Path) -> Iterator[Tuple[List[bytes], int]]:
+    """
+    Yield (lines, residues) for every record, lines keep their newlines.
+    """
+    lines, residues = [], 0
+    with open(in_faa, "rb", buffering=BUFFER_SIZE) as h:
+        for line in h:
+            if line.startswith(b">"):
+                if lines:
+                    yield lines, residues
+                lines, residues = [line], 0
+            elif lines and (seq := line.rstrip()):
+                lines.append(seq + b"\n")
+                residues += len(seq)
+    if lines:
+        yield lines, residues
+
+
+def format_record(lines: List[bytes], width: int) -> bytes:
+    return rewrap(b"".join(lines), width)
+
+
+def count(in_faa: Path, max_residues: int = 0) -> Tuple[int, int]:
+    """
+    Records and residues, of the records up to max_residues long if given.
+    """
+    records, residues = 0, 0
+    for _, n in read_records(in_faa):
+        if max_residues and n > max_residues:
+            continue
+        records += 1
+        residues += n
+    return records, residues
+
+
+def split_sequential(
+    in_faa: Path, out_dir: Path, width: int, max_records: int, max_residues: int
+) -> Tuple[int, int]:
+    """
+    Returns:
+        (pieces, records) written.
+    """
+    ipiece, written = 0, 0
+    out = None
+    records, residues = 0, 0
+
+    for lines, n in read_records(in_faa):
+        full = (max_records and records >= max_records) or (
+            max_residues and records > 0 and residues + n > max_residues
+        )
+        if out is None or full:
+            if out is not None:
+                out.close()
+            ipiece += 1
+            out = open(out_dir / f"{ipiece}.faa", "wb", buffering=BUFFER_SIZE)
+            records, residues = 0, 0
+
+        out.write(format_record(lines, width))
+        records += 1
+        residues += n
+        written += 1
+
+    if out is not None:
+        out.close()
+
+    return ipiece, written
+
+
+def split_balanced(
+    in_faa: Path, out_dir: Path, width: int, n_pieces: int, max_residues: int = 0
+) -> Tuple[int, int]:
+    """
+    Records longer than max_residues, if given, go to pieces of their own.
+    Pieces are opened on their first record and numbered from 1 in the end.
+
+    Returns:
+        (pieces, records) written.
+    """
+    outs = {}
+    loads = [(0, i) for i in range(n_pieces)]  # (residues, piece) min-heap
+    solo = n_pieces  # ids of the pieces of long records
+    written = 0
+
+    def piece(i: int):
+        if i not in outs:
+            path = out_dir / f".{i}.faa"
+            outs[i] = open(path, "wb", buffering=BUFFER_SIZE // 16)
+        return outs[i]
+
+    for lines, n in read_records(in_faa):
+        if (max_residues and n > max_residues) or not loads:
+            piece(solo).write(format_record(lines, width))
+            solo += 1
+        else:
+            residues, i = heapq.heappop(loads)
+            piece(i).write(format_record(lines, width))
+            heapq.heappush(loads, (residues + n, i))
+        written += 1
+
+    for ipiece, i in enumerate(sorted(outs), start=1):
+        outs[i].close()
+        (out_dir / f".{i}.faa").rename(out_dir / f"{ipiece}.faa")
+
+    return len(outs), written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Split a FASTA file into pieces.")
+    parser.add_argument("in_faa", help="Input FASTA")
+    parser.add_argument("out_dir", help="Directory for the pieces, recreated")
+    parser.add_argument("sentinel", help="Written with the elapsed time when done")
+    parser.add_argument("--width", type=int, default=80, help="Sequence line width")
+    parser.add_argument("--records", type=int, default=8000, help="Records per piece")
+    parser.add_argument(
+        "--residues", type=int, default=0, help="Cut by residues instead (0: off)"
+    )
+    parser.add_argument(
+        "--balance",
+        action="store_true",
+        help="Spread records over records/N pieces with equal residues",
+    )
+    args = parser.parse_args()
+
+    start = datetime.today()
+
+    in_faa = Path(args.in_faa)
+    out_dir = Path(args.out_dir)
+    if out_dir.exists():
+        rmtree(out_dir)
+    out_dir.mkdir(parents=True)
+
+    with Stage("split_faa") as stage:
+        if args.balance:
+            records, residues = count(in_faa, args.residues)
+            if args.residues > 0:
+                n_pieces = max(-(-residues // args.residues), min(records, 1))
+            else:
+                n_pieces = -(-records // args.records)
+            pieces, written = split_balanced(
+                in_faa, out_dir, args.width, n_pieces, args.residues
+            )
+        elif args.residues > 0:
+            pieces, written = split_sequential(
+                in_faa, out_dir, args.width, 0, args.residues
+            )
+        else:
+            pieces, written = split_sequential(
+                in_faa, out_dir, args.width, args.records, 0
+            )
+        stage.add(written)
+
+    print(f"Wrote {written} records in {pieces} pieces to {out_dir}", file=sys.stderr)
+
+    end = datetime.today()
+    with open(args.sentinel, "w") as h_sentinel:
+        h_sentinel.write(f"{end - start}\n")
+
+
+if __name__ == "__main__":
+    main()